@@ -0,0 +1,58 @@
+"""
+meta growth under a synthetic workload, per bucket policy.
+simulates sets at a fixed rate with random expirations,
+expired buckets are pruned as the simulated clock moves.
+run from the repository root (or after `pip install -e .`)
+
+    python -m benchmarks.bench_buckets --hours 48 --sets-per-minute 20
+"""
+import argparse
+import datetime
+import json
+import random
+
+from ekring.utils import bucket_date
+
+DATE_FORMAT = "%Y%m%d%H%M%S"
+# placeholder with the length of a generated encryption key
+KEY = "k" * 43
+
+
+def simulate(policy : str, hours : int, sets_per_minute : int, seed : int):
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 1, 1)
+    buckets = {}
+    created = 0
+    peak = 0
+    for _ in range(hours * 60):
+        for _ in range(sets_per_minute):
+            # mostly short lived tokens, some long lived secrets
+            if rng.random() < 0.8:
+                offset = datetime.timedelta(seconds=rng.randint(60, 4 * 3600))
+            else:
+                offset = datetime.timedelta(seconds=rng.randint(86400, 90 * 86400))
+            datestr = bucket_date(now + offset, policy, now).strftime(DATE_FORMAT)
+            if datestr not in buckets:
+                buckets[datestr] = KEY
+                created += 1
+
+        now += datetime.timedelta(minutes=1)
+        nowstr = now.strftime(DATE_FORMAT)
+        buckets = {datestr : key for datestr, key in buckets.items() if datestr >= nowstr}
+        peak = max(peak, len(buckets))
+
+    size = len(json.dumps({"date_encryption" : buckets}))
+    return created, peak, len(buckets), size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--sets-per-minute", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'policy':<8} {'keys created':>12} {'peak keys':>10} {'final keys':>10} {'meta bytes':>11}")
+    for policy in ["legacy", "minute", "hour", "day", "log"]:
+        created, peak, final, size = simulate(policy, args.hours, args.sets_per_minute, args.seed)
+        print(f"{policy:<8} {created:>12} {peak:>10} {final:>10} {size:>11}")
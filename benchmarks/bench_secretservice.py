@@ -0,0 +1,60 @@
+"""
+compares keyring's SecretService backend against PooledSecretServiceKeyring,
+both talking to LocalSecretService, a stand-in Secret Service on a private dbus-daemon.
+run from the repository root (or after `pip install -e .`)
+
+    python -m benchmarks.bench_secretservice --entries 200 --latency 0.0005
+
+the stand-in only serves the part of the Secret Service API that ekring uses, with plain sessions and no prompts,
+so transport encryption and unlock prompts of a desktop keyring are not measured
+"""
+import argparse
+import os
+import time
+
+from keyring.backends.SecretService import Keyring
+
+from ekring.secretservice import LocalSecretService, PooledSecretServiceKeyring
+
+
+def run(label : str, service : LocalSecretService, set_password, get_passwords, entries : int):
+    round_trips = service.round_trips
+    connections = service.connections
+    start = time.perf_counter()
+    for i in range(entries):
+        set_password("bench", f"user{i}", f"password{i}")
+    get_passwords([("bench", f"user{i}") for i in range(entries)])
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<16} {elapsed:8.3f}s {2 * entries / elapsed:10.0f} ops/s "
+        f"{service.round_trips - round_trips:8} round trips {service.connections - connections:6} connections"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0005, help="seconds per simulated round trip")
+    args = parser.parse_args()
+
+    with LocalSecretService(args.latency, locked=False) as service:
+        os.environ["DBUS_SESSION_BUS_ADDRESS"] = service.address
+
+        backend = Keyring()
+        run(
+            "keyring backend", service, backend.set_password,
+            lambda pairs : [backend.get_password(*pair) for pair in pairs], args.entries
+        )
+
+        pooled = PooledSecretServiceKeyring()
+        run(
+            "pooled", service, pooled.set_password,
+            lambda pairs : [pooled.get_password(*pair) for pair in pairs], args.entries
+        )
+        pooled.close()
+
+        pooled = PooledSecretServiceKeyring()
+        run("pooled batch", service, pooled.set_password, pooled.get_passwords, args.entries)
+        pooled.close()
+
+    print("round trips are calls the stand-in served, calls the bus daemon answers itself (Hello, AddMatch) are not")
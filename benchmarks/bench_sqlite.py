@@ -0,0 +1,81 @@
+"""
+compares the sqlite store, the factory on the sqlite backend and the factory on the OS keyring.
+run from the repository root
+
+    python -m benchmarks.bench_sqlite --entries 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+from unittest import mock
+
+from ekring import os_kr
+from ekring.ek import ExpirableKeyringFactory
+from ekring.sqlite_store import SQLiteExpirableStore
+
+
+def timed(label : str, count : int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f}s {count / elapsed:10.0f} ops/s")
+
+
+def bench_sqlite(entries : int):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteExpirableStore(os.path.join(tmp, "bench.db"), "bench")
+        rows = [("bench", f"user{i}", f"password{i}", "in 2 days") for i in range(entries)]
+
+        timed("sqlite set_many", entries, lambda : store.set_many(rows))
+        timed("sqlite set_password", entries, lambda : [store.set_password(*row) for row in rows])
+        timed("sqlite get_password", entries, lambda : [store.get_password(s, u) for s, u, _, _ in rows])
+        store.set_many((s, u, p, "in 1 second") for s, u, p, _ in rows)
+        time.sleep(1.5)
+        timed("sqlite prune_expired", entries, store.prune_expired)
+        store.close()
+
+
+def bench_factory(label : str, factory : ExpirableKeyringFactory, entries : int):
+    rows = [("ekr_bench", f"user{i}", f"password{i}", "in 2 days") for i in range(entries)]
+    try:
+        timed(f"{label} set_password", entries, lambda : [factory.set_password(*row) for row in rows])
+        timed(f"{label} get_password", entries, lambda : [factory.get_password(s, u) for s, u, _, _ in rows])
+    finally:
+        factory.purge_all()
+
+
+def bench_sqlite_backend(entries : int):
+    default_keyring = os_kr.DEFAULT_KEYRING
+    with tempfile.TemporaryDirectory() as tmp:
+        with mock.patch.dict(os.environ, {"EKRING_SQLITE_SECRET" : "bench"}):
+            factory = ExpirableKeyringFactory(
+                META_NAME="EKR_META_BENCH", BACKEND="sqlite", SQLITE_PATH=os.path.join(tmp, "bench.db")
+            )
+        try:
+            bench_factory("factory on sqlite", factory, entries)
+        finally:
+            os_kr.DEFAULT_KEYRING.store.close()
+            os_kr.DEFAULT_KEYRING = default_keyring
+
+
+def bench_keyring(entries : int):
+    try:
+        factory = ExpirableKeyringFactory(META_NAME="EKR_META_BENCH")
+    except Exception as e:
+        print(f"keyring unavailable, skipped ({e})")
+        return
+
+    bench_factory("factory on keyring", factory, entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--skip-keyring", action="store_true")
+    args = parser.parse_args()
+
+    bench_sqlite(args.entries)
+    bench_sqlite_backend(args.entries)
+    if not args.skip_keyring:
+        bench_keyring(args.entries)
@@ -20,14 +20,18 @@ class ExpirableKeyringBackend(KeyringBackend):
         self.factory = ExpirableKeyringFactory()
 
     @staticmethod
-    def init(metaname :str, metakey :str, secretkey :str, dateformat :str, prunetype :str):
+    def init(
+        metaname :str, metakey :str, secretkey :str, dateformat :str, prunetype :str, bucketpolicy :str = None,
+        backend :str = None, sqlitepath :str = None
+    ):
         with open(config_path, "w") as f:
             options = {
                 "META_NAME": metaname,
                 "META_KEY": metakey,
                 "SECRET_KEY": secretkey,
                 "DATE_FORMAT": dateformat,
-                "PRUNE_ACTION_TYPE": prunetype
+                "PRUNE_ACTION_TYPE": prunetype,
+                "BUCKET_POLICY": bucketpolicy
             }
 
             options = {k:v for k,v in options.items() if v is not None}
@@ -25,14 +25,23 @@ def cli():
 @click.option("--secretkey", default=None)
 @click.option("--dateformat", default=None)
 @click.option("--prunetype", default=None, type=click.Choice(["on_startup", "on_execution","task_scheduler"]))
-def init(metaname :str, metakey :str, secretkey :str, dateformat :str, prunetype :str):
+@click.option("--bucketpolicy", default=None, type=click.Choice(["legacy", "minute", "hour", "day", "log"]))
+@click.option("--backend", default=None, type=click.Choice(["keyring", "sqlite"]))
+@click.option("--sqlitepath", default=None)
+def init(
+    metaname :str, metakey :str, secretkey :str, dateformat :str, prunetype :str, bucketpolicy :str,
+    backend :str, sqlitepath :str
+):
     with open(config_path, "w") as f:
         options = {
             "META_NAME": metaname,
             "META_KEY": metakey,
             "SECRET_KEY": secretkey,
             "DATE_FORMAT": dateformat,
-            "PRUNE_ACTION_TYPE": prunetype
+            "PRUNE_ACTION_TYPE": prunetype,
+            "BUCKET_POLICY": bucketpolicy,
+            "BACKEND": backend,
+            "SQLITE_PATH": sqlitepath
         }
 
         options = {k:v for k,v in options.items() if v is not None}
@@ -78,7 +87,8 @@ def differ(service :str, name :str, differs_by :str):
 @click.argument('name')
 @click.argument('password')
 @click.argument('expiration')
-def set(service :str, name :str, password :str, expiration :str):
+@click.option("--sliding", default=None)
+def set(service :str, name :str, password :str, expiration :str, sliding :str):
     try:
         if "." in expiration and expiration.replace(".", "").isdigit():
             expiration = float(expiration)
@@ -86,7 +96,7 @@ def set(service :str, name :str, password :str, expiration :str):
             expiration = int(expiration)
         
 
-        factory.set_password(service, name, password, expiration)
+        factory.set_password(service, name, password, expiration, sliding)
     except Exception as e:
         click.echo("INVALID")
         click.echo(e)
@@ -104,6 +114,21 @@ def delete(service :str, name :str):
         click.echo("ERROR")
         click.echo(e)
     
+@cli.command()
+@click.option("--iterations", default=None, type=int)
+@click.option("--workers", default=None, type=int)
+def rotate(iterations :int, workers :int):
+    def progress(done :int, total :int):
+        click.echo(f"\r{done}/{total}", nl=False)
+        if done == total:
+            click.echo()
+
+    try:
+        factory.rotate_keys(iterations, workers, progress)
+    except Exception as e:
+        click.echo("ERROR")
+        click.echo(e)
+
 @cli.group()
 def secret():
     pass
@@ -151,7 +176,51 @@ def delete_secret(name :str):
     except Exception as e:
         click.echo("ERROR")
         raise e
-    
+
+@cli.group()
+def service():
+    pass
+
+@service.command("list")
+@click.argument('name')
+@click.option("--prefix", is_flag=True, default=False)
+def list_service(name :str, prefix :bool):
+    try:
+        res = factory.list_service(name, prefix)
+        for svc, usernames in res.items():
+            for username in usernames:
+                click.echo(f"{svc} {username}")
+    except Exception as e:
+        click.echo("ERROR")
+        click.echo(e)
+
+@service.command("delete")
+@click.argument('name')
+@click.option("--prefix", is_flag=True, default=False)
+def delete_service(name :str, prefix :bool):
+    try:
+        factory.delete_service(name, prefix)
+    except NotAnExpirableKey:
+        click.echo("INVALID")
+    except Exception as e:
+        click.echo("ERROR")
+        click.echo(e)
+
+@service.command("differ")
+@click.argument('name')
+@click.argument('differs_by')
+@click.option("--prefix", is_flag=True, default=False)
+def differ_service(name :str, differs_by :str, prefix :bool):
+    try:
+        factory.differ_service(name, differs_by, prefix)
+    except NotAnExpirableKey:
+        click.echo("INVALID")
+    except AlreadyExpiredKey:
+        click.echo("EXPIRED")
+    except Exception as e:
+        click.echo("ERROR")
+        click.echo(e)
+
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -1,16 +1,53 @@
+import atexit
+import bisect
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass, field
 import datetime
+import functools
+import os
+import threading
 import typing
+import weakref
 from ekring.os_kr import (
-    delete_password, get_password, has_password, set_password
+    delete_password, delete_passwords, get_password, get_passwords, has_password, set_password, use_sqlite
 )
 import json
-from ekring.password import password_decrypt, password_encrypt, password_encrypt_with_gen
+from cryptography.fernet import InvalidToken
+from ekring.password import (
+    generate_password, password_decrypt, password_encrypt, password_encrypt_with_gen, password_rotate
+)
+from ekring.password import iterations as default_iterations
 from ekring.utils import (
+    BucketPolicy,
     default_counter,
-    parse_date_info
+    parse_date_info,
+    parse_duration
 )
 
+# factories with buffered sliding expiration touches, flushed at exit
+_touched_factories : "weakref.WeakValueDictionary[int, ExpirableKeyringFactory]" = weakref.WeakValueDictionary()
+
+@atexit.register
+def _flush_touched_factories():
+    for factory in list(_touched_factories.values()):
+        factory.flush_touches()
+
+def _flush_later(ref : "weakref.ref[ExpirableKeyringFactory]"):
+    factory = ref()
+    if factory is not None:
+        factory.flush_touches()
+
+def _locked(func):
+    """
+    runs a factory method while holding the factory's lock
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
 class NotAnExpirableKey(Exception):
     pass
 
@@ -21,11 +58,27 @@ class ExpirableKeyringMeta:
     _factory : "ExpirableKeyringFactory"
     date_encryption : typing.Dict[str, str]
     name_dates : typing.Dict[str, str]
+    # datestr -> new encryption key while a key rotation is in progress
+    pending_rotation : typing.Dict[str, str]
+    # name -> sliding ttl in seconds, extended on every get_password
+    name_sliding : typing.Dict[str, float]
+    # KDF iterations for newly encrypted entries, changed by rotate_keys
+    iterations : int
+    # service -> username -> datestr, rebuilt from name_dates on fetch
+    service_index : typing.Dict[str, typing.Dict[str, str]]
+    _sorted_services : typing.List[str]
+    # datestr -> number of entries in that bucket
+    date_counts : typing.Counter[str]
     _cached_dates : typing.Dict[str, datetime.datetime]
+    # called with the names set or removed since the previous write, after every update_meta
+    listeners : typing.List[typing.Callable[[typing.Set[str]], None]]
+    _changed : typing.Set[str]
 
     def __init__(self, factory : "ExpirableKeyringFactory"):
         self._factory = factory
         self._cached_dates = {}
+        self.listeners = []
+        self._changed = set()
         self._fetch_pairs()
 
     def _fetch_pairs(self):
@@ -33,14 +86,69 @@ class ExpirableKeyringMeta:
         if raw is None:
             self.date_encryption = {}
             self.name_dates = {}
+            self.pending_rotation = {}
+            self.name_sliding = {}
+            self.iterations = default_iterations
+            self._build_index()
             return
 
         json_raw = json.loads(raw)
         self.date_encryption = json_raw["date_encryption"]
         self.name_dates = json_raw["name_dates"]
+        self.pending_rotation = json_raw.get("pending_rotation", {})
+        self.name_sliding = json_raw.get("name_sliding", {})
+        self.iterations = json_raw.get("iterations", default_iterations)
+        self._build_index()
+
+    def _build_index(self):
+        self.service_index = {}
+        for name, datestr in self.name_dates.items():
+            svc, username = name.split("|", 1)
+            self.service_index.setdefault(svc, {})[username] = datestr
+        self._sorted_services = sorted(self.service_index)
+        self.date_counts = Counter(self.name_dates.values())
+
+    def _count_remove(self, datestr : str):
+        self.date_counts[datestr] -= 1
+        if self.date_counts[datestr] <= 0:
+            del self.date_counts[datestr]
+
+    def _index_add(self, service : str, username : str, datestr : str):
+        if service not in self.service_index:
+            self.service_index[service] = {}
+            bisect.insort(self._sorted_services, service)
+        self.service_index[service][username] = datestr
+
+    def _index_remove(self, service : str, username : str):
+        usernames = self.service_index.get(service)
+        if usernames is None:
+            return
+        usernames.pop(username, None)
+        if not usernames:
+            del self.service_index[service]
+            self._sorted_services.pop(bisect.bisect_left(self._sorted_services, service))
 
     def has_username(self, service : str, username : str):
         return f"{service}|{username}" in self.name_dates
+
+    def has_service(self, service : str):
+        return service in self.service_index
+
+    def yield_services(self, prefix : str = ""):
+        """
+        yields service names starting with prefix, in sorted order
+        """
+        start = bisect.bisect_left(self._sorted_services, prefix)
+        for svc in self._sorted_services[start:]:
+            if not svc.startswith(prefix):
+                break
+            yield svc
+
+    def get_service(self, service : str) -> typing.Dict[str, str]:
+        """
+        returns a username -> datestr mapping for the service
+        """
+        return dict(self.service_index.get(service, {}))
     
     def has_date(self, date_str : str):
         return date_str in self.date_encryption
@@ -60,7 +168,12 @@ class ExpirableKeyringMeta:
         if datestr not in self.date_encryption:
             raise ValueError("date not found")
         
+        if name in self.name_dates:
+            self._count_remove(self.name_dates[name])
         self.name_dates[name] = datestr
+        self.date_counts[datestr] += 1
+        self._index_add(service, username, datestr)
+        self._changed.add(name)
 
     def set_encryption_key(self, datestr :str, encryption_key : str):
         if datestr in self.date_encryption:
@@ -75,28 +188,57 @@ class ExpirableKeyringMeta:
         set_password(self._factory.META_KEY, self._factory.META_NAME, json.dumps(
             {
                 "date_encryption" : self.date_encryption,
-                "name_dates" : self.name_dates
+                "name_dates" : self.name_dates,
+                "pending_rotation" : self.pending_rotation,
+                "name_sliding" : self.name_sliding,
+                "iterations" : self.iterations
             }
         ))
 
+        changed, self._changed = self._changed, set()
+        for listener in self.listeners:
+            listener(changed)
+
     def delete_entry(self, service : str, username : str, skipCheckDateEncrypted : bool = False):
         name = f"{service}|{username}"
         if name not in self.name_dates:
             raise ValueError("entry not found")
         
-        date_str = self.name_dates[name]
-        del self.name_dates[name]
+        date_str = self.pop_entry(service, username)
         if skipCheckDateEncrypted and date_str not in self.name_dates.values():
             del self.date_encryption[date_str]
 
         self.update_meta()
 
+    def pop_entry(self, service : str, username : str):
+        """
+        removes an entry without writing the meta, returns its datestr
+        """
+        date_str = self.name_dates.pop(f"{service}|{username}")
+        self.name_sliding.pop(f"{service}|{username}", None)
+        self._count_remove(date_str)
+        self._index_remove(service, username)
+        self._changed.add(f"{service}|{username}")
+        return date_str
+
+    def drop_unused_dates(self, datestrs : typing.Iterable[str]):
+        """
+        removes encryption keys of the given dates that no entry refers to anymore
+        """
+        in_use = set(self.name_dates.values())
+        for datestr in set(datestrs):
+            if datestr not in in_use:
+                self.date_encryption.pop(datestr, None)
+
     def delete_date(self, datestr :str):
         if datestr not in self.date_encryption:
             raise ValueError("date not found")
 
         del self.date_encryption[datestr]
+        self._changed.update(k for k, v in self.name_dates.items() if v == datestr)
         self.name_dates = {k : v for k, v in self.name_dates.items() if v != datestr}
+        self.name_sliding = {k : v for k, v in self.name_sliding.items() if k in self.name_dates}
+        self._build_index()
         self.update_meta()
 
     def yield_dates(self):
@@ -128,12 +270,32 @@ class ExpirableKeyringFactory:
     #"YYYYMMDDHHMMSS"
     DATE_FORMAT : str = "%Y%m%d%H%M%S"
     PRUNE_ACTION_TYPE : typing.Literal["on_startup", "on_execution","task_scheduler"] = "on_execution"
+    # how expirations are rounded into date buckets, see utils.bucket_date
+    BUCKET_POLICY : BucketPolicy = "legacy"
+    # "sqlite" keeps all entries and the meta in an encrypted sqlite file at SQLITE_PATH instead of the OS keyring,
+    # its secret is read from the EKRING_SQLITE_SECRET environment variable
+    BACKEND : typing.Literal["keyring", "sqlite"] = "keyring"
+    SQLITE_PATH : str = "~/.ekring.db"
+    # seconds sliding expiration touches are buffered before a timer thread writes them to the meta
+    TOUCH_FLUSH_INTERVAL : float = 30.0
     meta : ExpirableKeyringMeta = field(init=False)
+    # held by every operation, so the flush timer and event threads never interleave with the caller
+    lock : threading.RLock = field(init=False, repr=False, compare=False, default_factory=threading.RLock)
+    _touches : typing.Dict[str, datetime.datetime] = field(init=False, default_factory=dict)
+    _flush_timer : typing.Optional[threading.Timer] = field(init=False, default=None, repr=False, compare=False)
 
     def __post_init__(self):
         if self.PRUNE_ACTION_TYPE == "task_scheduler":
             raise NotImplementedError("task_scheduler not implemented yet")
 
+        if self.BACKEND == "sqlite":
+            secret = os.environ.get("EKRING_SQLITE_SECRET")
+            if not secret:
+                raise ValueError("EKRING_SQLITE_SECRET must be set to use the sqlite backend")
+            use_sqlite(os.path.expanduser(self.SQLITE_PATH), secret)
+        elif self.BACKEND != "keyring":
+            raise ValueError(f"invalid backend {self.BACKEND}")
+
         self.meta = ExpirableKeyringMeta(self)
 
         if self.PRUNE_ACTION_TYPE == "on_startup":
@@ -143,35 +305,62 @@ class ExpirableKeyringFactory:
     def ensure_bypass_20_limit():
         raise NotImplementedError("ensure_bypass_20_limit not implemented yet")
 
+    @_locked
     def prune_expired(self):
-        expired_datestr = []
-        for datestr, _, svc, username in self.meta.yield_expired():
-            self.meta.delete_entry(svc, username)
-            delete_password(svc, username)
-            if datestr not in expired_datestr:
-                expired_datestr.append(datestr)
-        
+        now = datetime.datetime.now()
+        expired = []
+        expired_datestr = set()
+        for datestr, _, svc, username in list(self.meta.yield_expired()):
+            touched = self._touches.get(f"{svc}|{username}")
+            if touched is not None and touched >= now:
+                continue
+            expired.append((svc, username))
+            expired_datestr.add(datestr)
+
+        if not expired:
+            return
+
+        delete_passwords(expired)
+        for svc, username in expired:
+            self.meta.pop_entry(svc, username)
+        self.meta.drop_unused_dates(expired_datestr)
         self.meta.update_meta()
 
 
+    @_locked
     def prune_if_expired(self, datestr : str):
+        now = datetime.datetime.now()
         date_parsed = datetime.datetime.strptime(datestr, self.DATE_FORMAT)
-        if date_parsed >= datetime.datetime.now():
+        if date_parsed >= now:
             return False
-        
-        self.meta.delete_date(datestr)
+
+        # entries touched since the last flush outlive their bucket until the flush moves them
+        expired = [
+            name for name, entry_datestr in self.meta.name_dates.items()
+            if entry_datestr == datestr and (name not in self._touches or self._touches[name] < now)
+        ]
+        if len(expired) == self.meta.date_counts[datestr]:
+            self.meta.delete_date(datestr)
+        else:
+            for name in expired:
+                self.meta.pop_entry(*name.split("|", 1))
         self.meta.update_meta()
 
         return True
 
+    @_locked
     def set_password(
         self,
         service : str,
         username : str,
         password : str,
-        expiration_date : typing.Union[str, int, float, datetime.timedelta, datetime.datetime]
+        expiration_date : typing.Union[str, int, float, datetime.timedelta, datetime.datetime],
+        sliding : typing.Optional[typing.Union[str, int, float, datetime.timedelta]] = None
     ):
-        target_date = parse_date_info(expiration_date)
+        """
+        if sliding is given, every get_password pushes the expiration to now + sliding
+        """
+        target_date = parse_date_info(expiration_date, self.BUCKET_POLICY)
         date_str = target_date.strftime(self.DATE_FORMAT)
 
         # if date already passed
@@ -180,16 +369,24 @@ class ExpirableKeyringFactory:
 
         if self.meta.has_date(date_str):
             encryption_key = self.meta.get_encryption_key(date_str)
-            encrypted_content = password_encrypt(password.encode(), encryption_key)
+            encrypted_content = password_encrypt(password, encryption_key, self.meta.iterations)
             self.meta.set_user(date_str,service, username)
         else:
-            encrypted_content, encryption_key = password_encrypt_with_gen(password)
+            encrypted_content, encryption_key = password_encrypt_with_gen(password, self.meta.iterations)
             self.meta.set_encryption_key(date_str, encryption_key)
             self.meta.set_user(date_str,service, username)
+
+        name = f"{service}|{username}"
+        self._touches.pop(name, None)
+        if sliding is None:
+            self.meta.name_sliding.pop(name, None)
+        else:
+            self.meta.name_sliding[name] = parse_duration(sliding)
             
         set_password(service, username, encrypted_content)
         self.meta.update_meta()
 
+    @_locked
     def get_password(
         self, 
         service : str,
@@ -198,19 +395,115 @@ class ExpirableKeyringFactory:
         if not self.meta.has_username(service, username):
             raise NotAnExpirableKey(f"{service}:{username} not found")
 
-        datestr = self.meta.name_dates[f"{service}|{username}"]
+        name = f"{service}|{username}"
+        datestr = self.meta.name_dates[name]
+        touched = self._touches.get(name)
 
-        if self.prune_if_expired(datestr):
+        if (touched is None or touched < datetime.datetime.now()) and self.prune_if_expired(datestr):
             raise AlreadyExpiredKey(f"{service}:{username} already expired")
     
         encrypted_content = get_password(service, username)
         if encrypted_content is None:
             return None
 
-        encryption_key = self.meta.get_encryption_key(datestr)
-        decrypted = password_decrypt(encrypted_content, encryption_key)
+        decrypted = self._decrypt(encrypted_content, datestr)
+        if name in self.meta.name_sliding:
+            self._touch(name)
         return decrypted
-    
+
+    def _decrypt(self, encrypted_content : str, datestr : str) -> str:
+        """
+        decrypts an entry of the datestr bucket,
+        falls back to the bucket's pending key for entries an interrupted rotate_keys already re-encrypted
+        """
+        try:
+            return password_decrypt(encrypted_content, self.meta.get_encryption_key(datestr))
+        except InvalidToken:
+            if datestr not in self.meta.pending_rotation:
+                raise
+            return password_decrypt(encrypted_content, self.meta.pending_rotation[datestr])
+
+    def _touch(self, name : str):
+        self._touches[name] = parse_date_info(
+            datetime.timedelta(seconds=self.meta.name_sliding[name]), self.BUCKET_POLICY
+        )
+        if self._flush_timer is None:
+            # the timer only holds a weak reference, an unused factory is not kept alive until it fires
+            self._flush_timer = threading.Timer(self.TOUCH_FLUSH_INTERVAL, _flush_later, (weakref.ref(self),))
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+            _touched_factories[id(self)] = self
+
+    @_locked
+    def flush_touches(self):
+        """
+        moves all entries touched since the last flush to their new expiration,
+        with a single meta write.
+        called from a timer thread TOUCH_FLUSH_INTERVAL seconds after the first buffered touch and at exit,
+        reads never flush themselves
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        _touched_factories.pop(id(self), None)
+        touches, self._touches = self._touches, {}
+
+        # entries touched into the same bucket move together, so a whole bucket can hand over its key
+        by_date = {}
+        for name, target_date in touches.items():
+            if name not in self.meta.name_dates:
+                continue
+            entries = by_date.setdefault(target_date.strftime(self.DATE_FORMAT), (target_date, []))[1]
+            entries.append(tuple(name.split("|", 1)))
+
+        datestrs = []
+        for target_date, entries in by_date.values():
+            datestrs.extend(self._move_entries(entries, target_date))
+
+        if not datestrs:
+            return
+        self.meta.drop_unused_dates(datestrs)
+        self.meta.update_meta()
+
+    def _move_entries(
+        self,
+        entries : typing.Iterable[typing.Tuple[str, str]],
+        target_date : datetime.datetime
+    ) -> typing.List[str]:
+        """
+        moves (service, username) entries to the bucket of target_date without writing the meta,
+        returns their old datestrs, which the caller passes to drop_unused_dates.
+        a bucket whose entries all move hands its key to a new target bucket,
+        otherwise the moved entries are re-encrypted so a key never outlives its bucket
+        """
+        target_date_str = target_date.strftime(self.DATE_FORMAT)
+        by_date = {}
+        for service, username in entries:
+            datestr = self.meta.name_dates[f"{service}|{username}"]
+            if datestr != target_date_str:
+                by_date.setdefault(datestr, []).append((service, username))
+
+        for datestr, group in by_date.items():
+            encryption_key = self.meta.get_encryption_key(datestr)
+            if not self.meta.has_date(target_date_str):
+                if len(group) == self.meta.date_counts[datestr]:
+                    self.meta.set_encryption_key(target_date_str, encryption_key)
+                    if datestr in self.meta.pending_rotation:
+                        self.meta.pending_rotation[target_date_str] = self.meta.pending_rotation.pop(datestr)
+                else:
+                    self.meta.set_encryption_key(target_date_str, generate_password())
+
+            target_key = self.meta.get_encryption_key(target_date_str)
+            for service, username in group:
+                if target_key != encryption_key:
+                    encrypted_content = get_password(service, username)
+                    if encrypted_content is not None:
+                        decrypted = self._decrypt(encrypted_content, datestr)
+                        set_password(service, username, password_encrypt(decrypted, target_key, self.meta.iterations))
+                self.meta.set_user(target_date_str, service, username)
+
+        return list(by_date)
+
     def set_secret(
         self,
         name : str,
@@ -231,25 +524,31 @@ class ExpirableKeyringFactory:
     ):
         self.delete_password(self.SECRET_KEY, name)
 
+    @_locked
     def delete_password(
         self,
         service : str,
         username : str
     ):
-        if not self.meta.has_username(username):
+        if not self.meta.has_username(service, username):
             raise NotAnExpirableKey(f"username {username} not found")
         
+        self._touches.pop(f"{service}|{username}", None)
         delete_password(service, username)
         self.meta.delete_entry(service, username)
 
+    @_locked
     def purge_all(
         self
     ):
-        for date_str, _, svc, username in self.meta.yield_dates():
+        self._touches.clear()
+        for date_str, _, svc, username in list(self.meta.yield_dates()):
             delete_password(svc, username)
-            self.meta.delete_date(date_str)
+            if self.meta.has_date(date_str):
+                self.meta.delete_date(date_str)
         self.meta.update_meta()
     
+    @_locked
     def differ_password_expiration(
         self, 
         service : str,
@@ -259,20 +558,126 @@ class ExpirableKeyringFactory:
         if not self.meta.has_username(service, username):
             raise NotAnExpirableKey(f"{service}:{username} not found")
 
-        original_datestr = self.meta.name_dates[f"{service}|{username}"]
-        target_date = parse_date_info(expiration_date)
-        target_date_str = target_date.strftime(self.DATE_FORMAT)
-        
-        # check if only 1 datestr in meta
-        if self.meta.name_dates.values().count(original_datestr) == 1:
-            self.meta.name_dates[f"{service}|{username}"] = target_date_str
-            self.meta.update_meta()
-        else:
-            # if more than 1 datestr in meta, create new entry
-            self.set_password(
-                service,
-                username,
-                self.get_password(service, username),
-                target_date
+        self._touches.pop(f"{service}|{username}", None)
+        target_date = parse_date_info(expiration_date, self.BUCKET_POLICY)
+        self.meta.drop_unused_dates(self._move_entries([(service, username)], target_date))
+        self.meta.update_meta()
+
+    def _match_services(self, service : str, prefix : bool = False) -> typing.List[str]:
+        if prefix:
+            return list(self.meta.yield_services(service))
+        return [service] if self.meta.has_service(service) else []
+
+    @_locked
+    def list_service(
+        self,
+        service : str,
+        prefix : bool = False
+    ) -> typing.Dict[str, typing.List[str]]:
+        """
+        returns a service -> usernames mapping,
+        if prefix is set, all services starting with service are included
+        """
+        return {
+            svc : sorted(self.meta.get_service(svc))
+            for svc in self._match_services(service, prefix)
+        }
+
+    @_locked
+    def delete_service(
+        self,
+        service : str,
+        prefix : bool = False
+    ):
+        services = self._match_services(service, prefix)
+        if not services:
+            raise NotAnExpirableKey(f"service {service} not found")
+
+        datestrs = []
+        for svc in services:
+            for username in self.meta.get_service(svc):
+                delete_password(svc, username)
+                datestrs.append(self.meta.pop_entry(svc, username))
+
+        self.meta.drop_unused_dates(datestrs)
+        self.meta.update_meta()
+
+    @_locked
+    def differ_service(
+        self,
+        service : str,
+        expiration_date : typing.Union[str, int, float, datetime.timedelta, datetime.datetime],
+        prefix : bool = False
+    ):
+        services = self._match_services(service, prefix)
+        if not services:
+            raise NotAnExpirableKey(f"service {service} not found")
+
+        target_date = parse_date_info(expiration_date, self.BUCKET_POLICY)
+        if target_date < datetime.datetime.now():
+            raise AlreadyExpiredKey("expiration date already passed")
+
+        entries = [(svc, username) for svc in services for username in self.meta.get_service(svc)]
+        for svc, username in entries:
+            self._touches.pop(f"{svc}|{username}", None)
+
+        self.meta.drop_unused_dates(self._move_entries(entries, target_date))
+        self.meta.update_meta()
+
+    @_locked
+    def rotate_keys(
+        self,
+        iterations : typing.Optional[int] = None,
+        max_workers : typing.Optional[int] = None,
+        progress : typing.Optional[typing.Callable[[int, int], None]] = None
+    ) -> int:
+        """
+        generates a fresh key for every date bucket and re-encrypts all entries with it,
+        the new keys are journaled in the meta first so an interrupted run is resumed by the next call.
+        iterations is kept in the meta and used for every entry encrypted afterwards, it defaults to the current count.
+        progress is called with (done, total) after each entry, returns the number of re-encrypted entries
+        """
+        if iterations is not None:
+            self.meta.iterations = iterations
+        iterations = self.meta.iterations
+
+        resume = bool(self.meta.pending_rotation)
+        for datestr in self.meta.date_encryption:
+            if datestr not in self.meta.pending_rotation:
+                self.meta.pending_rotation[datestr] = generate_password()
+        self.meta.update_meta()
+
+        items = list(self.meta.yield_items())
+        contents = get_passwords((svc, username) for svc, username, _, _ in items)
+        jobs = {}
+        for svc, username, datestr, encryption_key in items:
+            encrypted_content = contents[(svc, username)]
+            if encrypted_content is None:
+                continue
+            jobs[(svc, username)] = (
+                encrypted_content, encryption_key, self.meta.pending_rotation[datestr], iterations, resume
             )
-            
\ No newline at end of file
+
+        rotated = 0
+        total = len(jobs)
+        # KDF and fernet work runs in the pool, keyring writes stay in this process
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(password_rotate, *args) : name
+                for name, args in jobs.items()
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                encrypted_content = future.result()
+                if encrypted_content is not None:
+                    set_password(*futures[future], encrypted_content)
+                    rotated += 1
+                if progress is not None:
+                    progress(done, total)
+
+        self.meta.date_encryption = {
+            datestr : self.meta.pending_rotation[datestr]
+            for datestr in self.meta.date_encryption
+        }
+        self.meta.pending_rotation = {}
+        self.meta.update_meta()
+        return rotated
@@ -0,0 +1,373 @@
+from dataclasses import dataclass
+import datetime
+import itertools
+import logging
+import threading
+import time
+import typing
+
+from ekring.ek import AlreadyExpiredKey, ExpirableKeyringFactory
+from ekring.utils import parse_duration
+
+logger = logging.getLogger(__name__)
+
+class TimingWheel:
+    """
+    hierarchical timing wheel,
+    level n has `slots` buckets each spanning slots**n ticks.
+    scheduling is O(1), items are cascaded one level down as the wheel turns
+    """
+    resolution : float
+    slots : int
+    levels : int
+    _now_tick : int
+    _wheels : typing.List[typing.List[list]]
+    _overflow : list
+    _count : int
+
+    def __init__(
+        self,
+        resolution : float = 1.0,
+        slots : int = 64,
+        levels : int = 4,
+        start : typing.Optional[float] = None
+    ):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._now_tick = int((time.time() if start is None else start) / resolution)
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def now(self) -> float:
+        """
+        timestamp up to which the wheel has been turned
+        """
+        return self._now_tick * self.resolution
+
+    def schedule(self, when : float, item : typing.Any):
+        """
+        schedules item to be returned by advance once `when` (a timestamp) is reached
+        """
+        self._place(max(int(when / self.resolution), self._now_tick), item)
+        self._count += 1
+
+    def _place(self, tick : int, item : typing.Any):
+        delta = tick - self._now_tick
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                self._wheels[level][(tick // span) % self.slots].append((tick, item))
+                return
+            span *= self.slots
+
+        self._overflow.append((tick, item))
+
+    def _cascade(self, tick : int):
+        span = self.slots ** self.levels
+        if tick % span == 0:
+            overflow, self._overflow = self._overflow, []
+            for entry in overflow:
+                self._place(*entry)
+
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if tick % span != 0:
+                continue
+            index = (tick // span) % self.slots
+            bucket, self._wheels[level][index] = self._wheels[level][index], []
+            for entry in bucket:
+                self._place(*entry)
+
+    def _next_tick(self, tick : int) -> int:
+        """
+        first tick after `tick` at which a level 0 slot is due or a higher slot has to be cascaded,
+        ticks in between only hold empty slots and can be skipped
+        """
+        candidates = []
+        if self._overflow:
+            span = self.slots ** self.levels
+            candidates.append((tick // span + 1) * span)
+
+        span = 1
+        for wheel in self._wheels:
+            first = tick // span + 1
+            for k in range(first, first + self.slots):
+                if wheel[k % self.slots]:
+                    candidates.append(k * span)
+                    break
+            span *= self.slots
+
+        return min(candidates)
+
+    def advance(self, now : typing.Optional[float] = None) -> list:
+        """
+        turns the wheel up to now and returns all items that became due,
+        the cost depends on the number of non empty slots passed, not on the elapsed time
+        """
+        target = int((time.time() if now is None else now) / self.resolution)
+        due = []
+        while self._now_tick <= target:
+            if self._count == 0:
+                self._now_tick = target + 1
+                break
+
+            tick = self._now_tick
+            self._cascade(tick)
+            index = tick % self.slots
+            bucket, self._wheels[0][index] = self._wheels[0][index], []
+            due.extend(item for _, item in bucket)
+            self._count -= len(bucket)
+            self._now_tick = min(self._next_tick(tick), target + 1) if self._count else target + 1
+
+        return due
+
+
+@dataclass
+class ExpirySubscription:
+    kind : typing.Literal["expiring", "expired", "refresh"]
+    callback : typing.Callable
+    # seconds before expiration, 0 for "expired"
+    lead : float = 0
+    service : typing.Optional[str] = None
+    username : typing.Optional[str] = None
+    # new expiration for values returned by a refresh hook
+    expiration : typing.Any = None
+
+    def matches(self, service : str, username : str):
+        if self.service is not None and self.service != service:
+            return False
+        if self.username is not None and self.username != username:
+            return False
+        return True
+
+
+class ExpiryEvents:
+    """
+    dispatches "expires in T" and "expired" callbacks for the entries of a factory,
+    driven by a single timing wheel built from the meta's expiration dates.
+
+    callbacks receive (service, username, expires_at),
+    refresh hooks receive (service, username, current_value) and may return a new value,
+    which is written back through factory.set_password with the hook's expiration.
+
+    entries are rescheduled whenever the factory writes its meta,
+    so entries set, differed or deleted through the factory need no extra calls.
+
+    poll can be driven by the caller or by start's daemon thread,
+    either way it holds factory.lock while it reads the meta or refreshes an entry,
+    so it never interleaves with the caller's own factory calls
+    """
+    factory : ExpirableKeyringFactory
+    wheel : TimingWheel
+    _subscriptions : typing.List[ExpirySubscription]
+    # (service, username) -> (datestr, generation) of the entry's current schedule
+    _scheduled : typing.Dict[typing.Tuple[str, str], typing.Tuple[str, int]]
+    # entries with items taken off the wheel by a poll that is still dispatching them
+    _in_flight : typing.Set[typing.Tuple[str, str]]
+
+    def __init__(self, factory : ExpirableKeyringFactory, resolution : float = 1.0):
+        self.factory = factory
+        self.resolution = resolution
+        self._subscriptions = []
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._generations = itertools.count()
+        self._in_flight = set()
+        self.rebuild()
+        factory.meta.listeners.append(self._on_meta_written)
+
+    def on_expiring(
+        self,
+        within : typing.Union[str, int, float, datetime.timedelta],
+        callback : typing.Callable[[str, str, datetime.datetime], None],
+        service : typing.Optional[str] = None,
+        username : typing.Optional[str] = None
+    ):
+        return self._subscribe(ExpirySubscription("expiring", callback, parse_duration(within), service, username))
+
+    def on_expired(
+        self,
+        callback : typing.Callable[[str, str, datetime.datetime], None],
+        service : typing.Optional[str] = None,
+        username : typing.Optional[str] = None
+    ):
+        return self._subscribe(ExpirySubscription("expired", callback, 0, service, username))
+
+    def on_refresh(
+        self,
+        within : typing.Union[str, int, float, datetime.timedelta],
+        hook : typing.Callable[[str, str, typing.Optional[str]], typing.Optional[str]],
+        expiration : typing.Union[str, int, float, datetime.timedelta, datetime.datetime],
+        service : typing.Optional[str] = None,
+        username : typing.Optional[str] = None
+    ):
+        return self._subscribe(
+            ExpirySubscription("refresh", hook, parse_duration(within), service, username, expiration)
+        )
+
+    def _subscribe(self, subscription : ExpirySubscription):
+        with self._lock:
+            self._subscriptions.append(subscription)
+            for (svc, username), (datestr, generation) in self._scheduled.items():
+                if subscription.matches(svc, username):
+                    self._schedule(svc, username, datestr, generation, subscription)
+        return subscription
+
+    def _expires_at(self, datestr : str) -> datetime.datetime:
+        return datetime.datetime.strptime(datestr, self.factory.DATE_FORMAT)
+
+    def _schedule(
+        self, service : str, username : str, datestr : str, generation : int, subscription : ExpirySubscription
+    ):
+        when = self._expires_at(datestr).timestamp() - subscription.lead
+        self.wheel.schedule(when, (service, username, datestr, generation, subscription))
+
+    def rebuild(self):
+        """
+        reschedules every entry currently in the meta
+        """
+        with self.factory.lock, self._lock:
+            self.wheel = TimingWheel(self.resolution)
+            self._scheduled = {}
+            for svc, username, datestr, _ in self.factory.meta.yield_items():
+                self.watch(svc, username, datestr)
+
+    def watch(self, service : str, username : str, datestr : typing.Optional[str] = None):
+        """
+        schedules a single entry, items of its previous schedule are dropped when they come due
+        """
+        with self.factory.lock, self._lock:
+            if datestr is None:
+                datestr = self.factory.meta.name_dates[f"{service}|{username}"]
+            current = self._scheduled.get((service, username))
+            if current is not None and current[0] == datestr:
+                return
+
+            generation = next(self._generations)
+            self._scheduled[(service, username)] = (datestr, generation)
+            for subscription in self._subscriptions:
+                if subscription.matches(service, username):
+                    self._schedule(service, username, datestr, generation, subscription)
+
+    def _on_meta_written(self, names : typing.Set[str]):
+        now = datetime.datetime.now()
+        with self._lock:
+            for name in names:
+                svc, username = name.split("|", 1)
+                datestr = self.factory.meta.name_dates.get(name)
+                if datestr is not None:
+                    self.watch(svc, username, datestr)
+                    continue
+
+                current = self._scheduled.get((svc, username))
+                if current is None:
+                    continue
+                # an entry pruned because it expired still gets its pending "expired" events,
+                # including those a running poll has not dispatched yet
+                expires_at = self._expires_at(current[0])
+                passed = expires_at.timestamp() < self.wheel.now and (svc, username) not in self._in_flight
+                if expires_at > now or passed or not self._has_expired_subscription(svc, username):
+                    del self._scheduled[(svc, username)]
+
+    def _has_expired_subscription(self, service : str, username : str):
+        return any(
+            subscription.kind == "expired" and subscription.matches(service, username)
+            for subscription in self._subscriptions
+        )
+
+    def poll(self, now : typing.Optional[float] = None) -> int:
+        """
+        fires all events that became due, returns the number of callbacks called.
+        events of entries that were rescheduled or deleted since are skipped
+        """
+        with self.factory.lock, self._lock:
+            due = self.wheel.advance(now)
+            in_flight = {(service, username) for service, username, _, _, _ in due}
+            self._in_flight |= in_flight
+
+        fired = 0
+        errors = []
+        for service, username, datestr, generation, subscription in due:
+            with self.factory.lock, self._lock:
+                if self._scheduled.get((service, username)) != (datestr, generation):
+                    continue
+
+                name = f"{service}|{username}"
+                meta_datestr = self.factory.meta.name_dates.get(name)
+                touched = self.factory._touches.get(name)
+                if meta_datestr is not None and touched is not None and touched > self._expires_at(meta_datestr):
+                    # a sliding touch is only written to the meta by the next flush
+                    meta_datestr = touched.strftime(self.factory.DATE_FORMAT)
+
+                if meta_datestr is None:
+                    if subscription.kind != "expired":
+                        continue
+                elif meta_datestr != datestr:
+                    # the meta was changed without a write, catch up instead of losing the entry
+                    self.watch(service, username, meta_datestr)
+                    continue
+            try:
+                self._dispatch(service, username, datestr, subscription)
+                fired += 1
+            except Exception as e:
+                errors.append(e)
+
+        with self.factory.lock, self._lock:
+            self._in_flight -= in_flight
+            for service, username in in_flight:
+                if f"{service}|{username}" not in self.factory.meta.name_dates:
+                    self._scheduled.pop((service, username), None)
+
+        if errors:
+            raise errors[0]
+        return fired
+
+    def _dispatch(self, service : str, username : str, datestr : str, subscription : ExpirySubscription):
+        if subscription.kind != "refresh":
+            subscription.callback(service, username, self._expires_at(datestr))
+            return
+
+        # the entry cannot change between reading it and writing the hook's value back
+        with self.factory.lock:
+            try:
+                current = self.factory.get_password(service, username)
+            except AlreadyExpiredKey:
+                return
+
+            value = subscription.callback(service, username, current)
+            if value is None:
+                return
+
+            self.factory.set_password(service, username, value, subscription.expiration)
+
+    def _run(self):
+        while not self._stop.wait(self.resolution):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("expiry event callback failed")
+
+    def start(self):
+        """
+        polls on a single daemon thread, callbacks are called from that thread.
+        errors raised by callbacks are logged to the ekring.events logger
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
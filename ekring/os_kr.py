@@ -1,4 +1,6 @@
 import os
+import sys
+import typing
 
 OS = os.name
 DEFAULT_KEYRING = None
@@ -6,6 +8,10 @@ if OS == "nt":
     from keyring.backends.Windows import WinVaultKeyring
     DEFAULT_KEYRING = WinVaultKeyring()
 #linux
+elif OS == "posix" and sys.platform.startswith("linux"):
+    from ekring.secretservice import PooledSecretServiceKeyring
+    DEFAULT_KEYRING = PooledSecretServiceKeyring()
+# other posix systems, secretstorage is only a dependency on linux
 elif OS == "posix":
     from keyring.backends.SecretService import Keyring
     DEFAULT_KEYRING = Keyring()
@@ -16,6 +22,14 @@ elif OS == "mac":
 else:
     raise NotImplementedError("Unsupported OS")
 
+def use_sqlite(path : str, secret : str):
+    """
+    replaces DEFAULT_KEYRING with an encrypted sqlite file, for machines without a usable OS keyring
+    """
+    global DEFAULT_KEYRING
+    from ekring.sqlite_store import SQLiteExpirableStore, SQLiteKeyring
+    DEFAULT_KEYRING = SQLiteKeyring(SQLiteExpirableStore(path, secret))
+
 def get_password(service_name : str, username : str):
     return DEFAULT_KEYRING.get_password(service_name, username)
 
@@ -28,6 +42,24 @@ def delete_password(service_name : str, username : str):
     except: # noqa
         pass
 
+def get_passwords(pairs : typing.Iterable[typing.Tuple[str, str]]):
+    """
+    looks up many (service, username) pairs at once where the keyring supports it, missing pairs map to None
+    """
+    if hasattr(DEFAULT_KEYRING, "get_passwords"):
+        return DEFAULT_KEYRING.get_passwords(pairs)
+    return {pair : DEFAULT_KEYRING.get_password(*pair) for pair in pairs}
+
+def delete_passwords(pairs : typing.Iterable[typing.Tuple[str, str]]):
+    """
+    deletes many (service, username) pairs at once where the keyring supports it, missing pairs are skipped
+    """
+    if hasattr(DEFAULT_KEYRING, "delete_passwords"):
+        DEFAULT_KEYRING.delete_passwords(pairs)
+        return
+    for pair in pairs:
+        delete_password(*pair)
+
 def has_password(service_name : str, username : str):
     try:
         res = DEFAULT_KEYRING.get_password(service_name, username)
@@ -36,5 +68,8 @@ def has_password(service_name : str, username : str):
         return False    
 
 
-__all__ = ["DEFAULT_KEYRING", "get_password", "set_password", "delete_password", "has_password"]
+__all__ = [
+    "DEFAULT_KEYRING", "use_sqlite", "get_password", "set_password", "delete_password",
+    "get_passwords", "delete_passwords", "has_password"
+]
 
@@ -1,6 +1,6 @@
 from cryptography.hazmat.primitives import hashes
 from base64 import urlsafe_b64encode as b64e, urlsafe_b64decode as b64d
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 import secrets
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -26,13 +26,33 @@ def password_encrypt(message: str, password: str, iterations: int = iterations)
         )
     ).decode()
 
-def password_encrypt_with_gen(message : str):
-    password = secrets.token_urlsafe(32)
-    return password_encrypt(message, password), password
+def generate_password() -> str:
+    return secrets.token_urlsafe(32)
+
+def password_encrypt_with_gen(message : str, iterations: int = iterations):
+    password = generate_password()
+    return password_encrypt(message, password, iterations), password
 
 def password_decrypt(token: bytes, password: str) -> str:
     decoded = b64d(token)
     salt, iter, token = decoded[:16], decoded[16:20], b64e(decoded[20:])
     iterations = int.from_bytes(iter, 'big')
     key = _derive_key(password.encode(), salt, iterations)
-    return Fernet(key).decrypt(token).decode()
\ No newline at end of file
+    return Fernet(key).decrypt(token).decode()
+
+def password_rotate(
+    token: str, old_password: str, new_password: str, iterations: int = iterations, resume: bool = False
+):
+    """
+    re-encrypts token under new_password, returns None if resume is set and
+    the token is already encrypted under new_password.
+    kept at module level so it can be sent to a process pool
+    """
+    if resume:
+        try:
+            password_decrypt(token, new_password)
+            return None
+        except InvalidToken:
+            pass
+
+    return password_encrypt(password_decrypt(token, old_password), new_password, iterations)
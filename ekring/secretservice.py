@@ -0,0 +1,443 @@
+import functools
+import itertools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import typing
+
+import secretstorage
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from jeepney import HeaderFields, MessageType, new_error, new_method_return
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import open_dbus_connection
+from jeepney.wrappers import DBusErrorResponse
+from keyring.errors import KeyringLocked, PasswordDeleteError
+from secretstorage.collection import COLLECTION_IFACE, SERVICE_IFACE
+from secretstorage.defines import SS_PATH, SS_PREFIX
+from secretstorage.exceptions import (
+    ItemNotFoundException, LockedException, PromptDismissedException, SecretServiceNotAvailableException
+)
+from secretstorage.item import ITEM_IFACE
+from secretstorage.util import DBusAddressWrapper, exec_prompt, open_session
+
+
+def _secretstorage_connect(preferred_collection : typing.Optional[str] = None):
+    connection = secretstorage.dbus_init()
+    if preferred_collection is not None:
+        return connection, secretstorage.Collection(connection, preferred_collection)
+    return connection, secretstorage.get_default_collection(connection)
+
+
+def _decode_secret(session, secret : tuple) -> bytes:
+    """
+    decodes a (session, parameters, value, content_type) secret struct the way secretstorage's Item.get_secret does
+    """
+    _, parameters, value, _ = secret
+    if not session.encrypted:
+        return bytes(value)
+    decryptor = Cipher(algorithms.AES(session.aes_key), modes.CBC(bytes(parameters)), default_backend()).decryptor()
+    padded = decryptor.update(bytes(value)) + decryptor.finalize()
+    return padded[:-padded[-1]]
+
+
+class PooledSecretServiceKeyring:
+    """
+    SecretService adapter that keeps one D-Bus connection, one unlocked collection and one session per process,
+    instead of reconnecting and checking the lock state on every call like keyring's backend does.
+    items are stored with the same attributes and label as keyring's SecretService backend,
+    preferred_collection is a collection path, like the keyring backend option of the same name.
+
+    reads and deletes address items by the paths SearchItems returns, without the per item property
+    round trips of secretstorage's Item, and secrets are fetched with a single GetSecrets call.
+    items locked on their own are unlocked one by one, as keyring's backend does.
+
+    connect returns a (connection, collection) pair, see LocalSecretService for a stand-in service
+    """
+    appid = "Python keyring library"
+    # errors after which the connection is dropped and the call retried once
+    reconnect_errors = (OSError, DBusErrorResponse, ItemNotFoundException, SecretServiceNotAvailableException)
+
+    def __init__(
+        self,
+        connect : typing.Optional[typing.Callable[[], tuple]] = None,
+        preferred_collection : typing.Optional[str] = None
+    ):
+        self._connect = connect or functools.partial(_secretstorage_connect, preferred_collection)
+        self._lock = threading.RLock()
+        self._pid = None
+        self._connection = None
+        self._collection = None
+        self._session = None
+
+    def _get_collection(self):
+        # a forked child must not share the parent's socket
+        if self._collection is None or self._pid != os.getpid():
+            self._connection, self._collection = self._connect()
+            self._session = None
+            self._pid = os.getpid()
+            self._unlock()
+        return self._collection
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = open_session(self._connection)
+            # create_item uses it instead of opening its own
+            self._collection.session = self._session
+        return self._session
+
+    def _unlock(self):
+        if self._collection.is_locked():
+            self._collection.unlock()
+            if self._collection.is_locked():
+                raise KeyringLocked("Failed to unlock the collection!")
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                try:
+                    self._connection.close()
+                except OSError:
+                    pass
+            self._connection = None
+            self._collection = None
+            self._session = None
+
+    def _call(self, func : typing.Callable):
+        with self._lock:
+            try:
+                return func(self._get_collection())
+            except LockedException:
+                # the collection was locked again since it was unlocked
+                self._unlock()
+            except self.reconnect_errors:
+                self.close()
+            return func(self._get_collection())
+
+    @staticmethod
+    def _query(service : str, username : typing.Optional[str] = None) -> typing.Dict[str, str]:
+        if username is None:
+            return {"service": service}
+        return {"username": username, "service": service}
+
+    def _search(self, collection, service : str, username : str) -> typing.List[str]:
+        wrapper = DBusAddressWrapper(collection.collection_path, COLLECTION_IFACE, collection.connection)
+        paths, = wrapper.call("SearchItems", "a{ss}", self._query(service, username))
+        return paths
+
+    def _get_secrets(self, collection, paths : typing.List[str]) -> typing.Dict[str, str]:
+        if not paths:
+            return {}
+        session = self._get_session()
+        service = DBusAddressWrapper(SS_PATH, SERVICE_IFACE, collection.connection)
+        secrets, = service.call("GetSecrets", "aoo", paths, session.object_path)
+        res = {path : _decode_secret(session, secret).decode("utf-8") for path, secret in secrets.items()}
+
+        # GetSecrets leaves out locked items
+        for path in paths:
+            if path in res:
+                continue
+            item = secretstorage.Item(collection.connection, path, session)
+            item.unlock()
+            if item.is_locked():
+                raise KeyringLocked("Failed to unlock the item!")
+            res[path] = item.get_secret().decode("utf-8")
+        return res
+
+    def _delete_item(self, collection, path : str):
+        prompt, = DBusAddressWrapper(path, ITEM_IFACE, collection.connection).call("Delete", "")
+        if prompt != "/":
+            dismissed, _ = exec_prompt(collection.connection, prompt)
+            if dismissed:
+                raise PromptDismissedException("Prompt dismissed.")
+
+    def get_password(self, service : str, username : str) -> typing.Optional[str]:
+        return self.get_passwords([(service, username)])[(service, username)]
+
+    def get_passwords(
+        self, pairs : typing.Iterable[typing.Tuple[str, str]]
+    ) -> typing.Dict[typing.Tuple[str, str], typing.Optional[str]]:
+        """
+        looks up many (service, username) pairs with one search per pair and one GetSecrets call for all of them,
+        missing pairs map to None
+        """
+        pairs = list(pairs)
+
+        def _get(collection):
+            paths = {}
+            for service, username in pairs:
+                found = self._search(collection, service, username)
+                if found:
+                    paths[(service, username)] = found[0]
+            secrets = self._get_secrets(collection, list(paths.values()))
+            return {pair : secrets[paths[pair]] if pair in paths else None for pair in pairs}
+
+        return self._call(_get)
+
+    def set_password(self, service : str, username : str, password : str) -> None:
+        attributes = dict(self._query(service, username), application=self.appid)
+        label = f"Password for '{username}' on '{service}'"
+
+        def _set(collection):
+            self._get_session()
+            collection.create_item(label, attributes, password, replace=True)
+
+        self._call(_set)
+
+    def delete_password(self, service : str, username : str) -> None:
+        def _delete(collection):
+            for path in self._search(collection, service, username):
+                return self._delete_item(collection, path)
+            raise PasswordDeleteError("No such password!")
+
+        self._call(_delete)
+
+    def delete_passwords(self, pairs : typing.Iterable[typing.Tuple[str, str]]) -> None:
+        """
+        deletes many (service, username) pairs, missing pairs are skipped
+        """
+        pairs = list(pairs)
+
+        def _delete(collection):
+            for service, username in pairs:
+                for path in self._search(collection, service, username):
+                    self._delete_item(collection, path)
+                    break
+
+        self._call(_delete)
+
+
+_PROPERTIES_IFACE = "org.freedesktop.DBus.Properties"
+_COLLECTION_PATH = SS_PATH + "/collection/login"
+_COLLECTION_PATHS = (SS_PATH + "/aliases/default", _COLLECTION_PATH)
+_SESSION_PREFIX = SS_PATH + "/session/"
+
+
+class _ServiceError(Exception):
+    def __init__(self, name : str, message : str):
+        super().__init__(message)
+        self.name = name
+
+
+class LocalSecretService:
+    """
+    stand-in Secret Service for tests and benchmarks on machines without a desktop keyring.
+    starts a private dbus-daemon (which has to be installed) at `address` and serves the part of
+    org.freedesktop.Secret that keyring and secretstorage use from a thread: plain sessions,
+    one default collection, searching, creating, reading and deleting items, locking and unlocking without prompts.
+    clients are the real secretstorage and jeepney code, `connect` is a connect function for PooledSecretServiceKeyring
+    and keyring's SecretService backend works once DBUS_SESSION_BUS_ADDRESS is set to `address`.
+
+    every method call the service handles counts as one round trip and sleeps for `latency` seconds,
+    calls the bus daemon answers itself (Hello, AddMatch) are not counted.
+    encrypted sessions are not offered, so clients fall back to plain ones
+    """
+    latency : float
+    round_trips : int
+    locked : bool
+    address : str
+
+    def __init__(self, latency : float = 0.0, locked : bool = True):
+        self.latency = latency
+        self.locked = locked
+        self.round_trips = 0
+        # path -> (label, attributes, secret, content_type)
+        self._items = {}
+        self._ids = itertools.count()
+        self._senders = set()
+        self._dir = tempfile.TemporaryDirectory()
+        self._socket = os.path.join(self._dir.name, "bus")
+        self.address = f"unix:path={self._socket}"
+        self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def connections(self) -> int:
+        """
+        number of client connections that made a call
+        """
+        return len(self._senders)
+
+    def _start(self):
+        dbus_daemon = shutil.which("dbus-daemon")
+        if dbus_daemon is None:
+            raise RuntimeError("LocalSecretService needs dbus-daemon")
+        if os.path.exists(self._socket):
+            os.unlink(self._socket)
+
+        self._daemon = subprocess.Popen(
+            [dbus_daemon, "--session", "--nofork", "--print-address", f"--address={self.address}"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        # the address is printed once the bus accepts connections
+        self._daemon.stdout.readline()
+        self._generation = object()
+        self._server = open_dbus_connection(bus=self.address)
+        self._server.send_and_get_reply(message_bus.RequestName("org.freedesktop.secrets"))
+        self._thread = threading.Thread(target=self._serve, args=(self._server, self._generation), daemon=True)
+        self._thread.start()
+
+    def _stop(self):
+        self._daemon.terminate()
+        self._daemon.wait()
+        self._daemon.stdout.close()
+        self._thread.join()
+        self._server.close()
+
+    def close(self):
+        self._stop()
+        self._dir.cleanup()
+
+    def drop_connections(self):
+        """
+        simulates a daemon restart on the same address, existing connections fail on their next call
+        """
+        self._stop()
+        self._start()
+
+    def _serve(self, server, generation):
+        while True:
+            try:
+                msg = server.receive()
+            except (OSError, ValueError):
+                # the bus daemon went away
+                return
+            if msg.header.message_type != MessageType.method_call:
+                continue
+
+            self.round_trips += 1
+            self._senders.add((generation, msg.header.fields.get(HeaderFields.sender)))
+            if self.latency:
+                time.sleep(self.latency)
+            try:
+                reply = self._handle(msg)
+            except _ServiceError as e:
+                reply = new_error(msg, e.name, "s", (str(e),))
+            try:
+                server.send(reply)
+            except OSError:
+                return
+
+    def _handle(self, msg):
+        path = msg.header.fields.get(HeaderFields.path)
+        interface = msg.header.fields.get(HeaderFields.interface)
+        member = msg.header.fields.get(HeaderFields.member)
+
+        if path == SS_PATH:
+            kind = "service"
+        elif path in _COLLECTION_PATHS:
+            kind = "collection"
+        elif path in self._items:
+            kind = "item"
+        elif path.startswith(_SESSION_PREFIX):
+            kind = "session"
+        else:
+            raise _ServiceError("org.freedesktop.DBus.Error.UnknownObject", f"no object at {path}")
+
+        if interface == _PROPERTIES_IFACE and member == "Get":
+            return new_method_return(msg, "v", (self._property(kind, path, msg.body[1]),))
+
+        handler = getattr(self, f"_{kind}_{member}", None)
+        if handler is None:
+            raise _ServiceError("org.freedesktop.DBus.Error.UnknownMethod", f"{member} is not supported")
+        return handler(msg, path, *msg.body)
+
+    def _property(self, kind : str, path : str, name : str) -> tuple:
+        if kind == "service" and name == "Collections":
+            return "ao", [_COLLECTION_PATH]
+        if kind == "collection" and name == "Label":
+            return "s", "Login"
+        if kind == "collection" and name == "Items":
+            return "ao", list(self._items)
+        if kind in ("collection", "item") and name == "Locked":
+            return "b", self.locked
+        if kind == "item" and name == "Label":
+            return "s", self._items[path][0]
+        if kind == "item" and name == "Attributes":
+            return "a{ss}", dict(self._items[path][1])
+        raise _ServiceError("org.freedesktop.DBus.Error.InvalidArgs", f"no property {name}")
+
+    def _search(self, attributes : typing.Dict[str, str]) -> typing.List[str]:
+        return [path for path, item in self._items.items() if attributes.items() <= item[1].items()]
+
+    def _check_unlocked(self):
+        if self.locked:
+            raise _ServiceError("org.freedesktop.Secret.Error.IsLocked", "collection is locked")
+
+    def _service_OpenSession(self, msg, path, algorithm, _):
+        if algorithm != "plain":
+            raise _ServiceError("org.freedesktop.DBus.Error.NotSupported", f"{algorithm} is not supported")
+        return new_method_return(msg, "vo", (("s", ""), f"{_SESSION_PREFIX}{next(self._ids)}"))
+
+    def _service_SearchItems(self, msg, path, attributes):
+        found = self._search(attributes)
+        return new_method_return(msg, "aoao", ([], found) if self.locked else (found, []))
+
+    def _service_Unlock(self, msg, path, paths):
+        self.locked = False
+        return new_method_return(msg, "aoo", (paths, "/"))
+
+    def _service_Lock(self, msg, path, paths):
+        self.locked = True
+        return new_method_return(msg, "aoo", (paths, "/"))
+
+    def _service_GetSecrets(self, msg, path, paths, session):
+        secrets = {}
+        if not self.locked:
+            secrets = {
+                item_path : (session, b"", self._items[item_path][2], self._items[item_path][3])
+                for item_path in paths if item_path in self._items
+            }
+        return new_method_return(msg, "a{o(oayays)}", (secrets,))
+
+    def _service_ReadAlias(self, msg, path, name):
+        return new_method_return(msg, "o", (_COLLECTION_PATH if name == "default" else "/",))
+
+    def _collection_SearchItems(self, msg, path, attributes):
+        return new_method_return(msg, "ao", (self._search(attributes),))
+
+    def _collection_CreateItem(self, msg, path, properties, secret, replace):
+        self._check_unlocked()
+        _, label = properties.get(SS_PREFIX + "Item.Label", ("s", ""))
+        _, attributes = properties.get(SS_PREFIX + "Item.Attributes", ("a{ss}", {}))
+        existing = [item_path for item_path, item in self._items.items() if item[1] == attributes]
+        item_path = existing[0] if replace and existing else f"{_COLLECTION_PATH}/{next(self._ids)}"
+        _, _, value, content_type = secret
+        self._items[item_path] = (label, dict(attributes), bytes(value), content_type)
+        return new_method_return(msg, "oo", (item_path, "/"))
+
+    def _item_GetSecret(self, msg, path, session):
+        self._check_unlocked()
+        _, _, value, content_type = self._items[path]
+        return new_method_return(msg, "(oayays)", ((session, b"", value, content_type),))
+
+    def _item_SetSecret(self, msg, path, secret):
+        self._check_unlocked()
+        label, attributes, _, _ = self._items[path]
+        _, _, value, content_type = secret
+        self._items[path] = (label, attributes, bytes(value), content_type)
+        return new_method_return(msg)
+
+    def _item_Delete(self, msg, path):
+        self._check_unlocked()
+        del self._items[path]
+        return new_method_return(msg, "o", ("/",))
+
+    def _session_Close(self, msg, path):
+        return new_method_return(msg)
+
+    def connect(self):
+        """
+        opens a client connection and the default collection, a connect function for PooledSecretServiceKeyring
+        """
+        connection = open_dbus_connection(bus=self.address)
+        return connection, secretstorage.Collection(connection)
@@ -0,0 +1,211 @@
+import datetime
+import secrets
+import sqlite3
+import threading
+import time
+import typing
+
+from cryptography.fernet import Fernet, InvalidToken
+from keyring.errors import PasswordDeleteError
+
+from ekring.ek import AlreadyExpiredKey, NotAnExpirableKey
+from ekring.password import _derive_key
+from ekring.utils import parse_date_info
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    service TEXT NOT NULL,
+    username TEXT NOT NULL,
+    value BLOB NOT NULL,
+    -- NULL for entries that never expire on their own
+    expires REAL,
+    PRIMARY KEY (service, username)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+_CHECK_VALUE = b"ekring"
+
+ExpirationDate = typing.Union[str, int, float, datetime.timedelta, datetime.datetime]
+
+
+class SQLiteExpirableStore:
+    """
+    store for expirable entries in a local sqlite file (WAL mode), for machines without a SecretService.
+    ExpirableKeyringFactory uses it through SQLiteKeyring when BACKEND is "sqlite".
+    values are encrypted at rest with a key derived once from secret,
+    entries are indexed by (service, username) and by expiration.
+    every thread gets its own connection, other processes may open the same file
+    """
+    path : str
+
+    def __init__(self, path : str, secret : str, timeout : float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(_SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO settings (name, value) VALUES ('salt', ?)", (secrets.token_bytes(16),)
+            )
+        salt = conn.execute("SELECT value FROM settings WHERE name = 'salt'").fetchone()[0]
+        self._fernet = Fernet(_derive_key(secret.encode(), salt))
+
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO settings (name, value) VALUES ('check', ?)",
+                (self._fernet.encrypt(_CHECK_VALUE),)
+            )
+        check = conn.execute("SELECT value FROM settings WHERE name = 'check'").fetchone()[0]
+        try:
+            self._fernet.decrypt(check)
+        except InvalidToken:
+            raise ValueError("secret does not match this store") from None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _expires(expiration_date : typing.Optional[ExpirationDate]) -> typing.Optional[float]:
+        if expiration_date is None:
+            return None
+        # rows keep their own timestamp, there are no key buckets to round into
+        target_date = parse_date_info(expiration_date, "exact")
+        if target_date < datetime.datetime.now():
+            raise AlreadyExpiredKey("expiration date already passed")
+        return target_date.timestamp()
+
+    def set_password(
+        self, service : str, username : str, password : str, expiration_date : typing.Optional[ExpirationDate] = None
+    ):
+        self.set_many([(service, username, password, expiration_date)])
+
+    def set_many(self, entries : typing.Iterable[typing.Tuple[str, str, str, typing.Optional[ExpirationDate]]]):
+        """
+        upserts (service, username, password, expiration_date) entries in a single transaction,
+        entries without an expiration_date are kept until deleted
+        """
+        rows = [
+            (service, username, self._fernet.encrypt(password.encode()), self._expires(expiration_date))
+            for service, username, password, expiration_date in entries
+        ]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO entries (service, username, value, expires) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (service, username) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+                rows
+            )
+
+    def get_password(self, service : str, username : str):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires FROM entries WHERE service = ? AND username = ?", (service, username)
+        ).fetchone()
+        if row is None:
+            raise NotAnExpirableKey(f"{service}:{username} not found")
+
+        value, expires = row
+        if expires is not None and expires < time.time():
+            with conn:
+                conn.execute(
+                    "DELETE FROM entries WHERE service = ? AND username = ? AND expires = ?",
+                    (service, username, expires)
+                )
+            raise AlreadyExpiredKey(f"{service}:{username} already expired")
+
+        return self._fernet.decrypt(value).decode()
+
+    def delete_password(self, service : str, username : str):
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM entries WHERE service = ? AND username = ?", (service, username))
+        if cursor.rowcount == 0:
+            raise NotAnExpirableKey(f"{service}:{username} not found")
+
+    def list_service(self, service : str, prefix : bool = False) -> typing.Dict[str, typing.List[str]]:
+        """
+        returns a service -> usernames mapping,
+        if prefix is set, all services starting with service are included
+        """
+        if not prefix:
+            rows = self._conn().execute(
+                "SELECT service, username FROM entries WHERE service = ? ORDER BY username", (service,)
+            )
+        else:
+            # every service starting with the prefix sorts below the prefix with its last
+            # incrementable character incremented, without one there is no upper bound
+            stem = service.rstrip(chr(0x10FFFF))
+            if stem:
+                # surrogates cannot be stored, the next code point after them is U+E000
+                upper = ord(stem[-1]) + 1
+                if 0xD800 <= upper <= 0xDFFF:
+                    upper = 0xE000
+                rows = self._conn().execute(
+                    "SELECT service, username FROM entries WHERE service >= ? AND service < ? "
+                    "ORDER BY service, username",
+                    (service, stem[:-1] + chr(upper))
+                )
+            else:
+                rows = self._conn().execute(
+                    "SELECT service, username FROM entries WHERE service >= ? ORDER BY service, username",
+                    (service,)
+                )
+
+        res = {}
+        for svc, username in rows:
+            res.setdefault(svc, []).append(username)
+        return res
+
+    def prune_expired(self) -> int:
+        """
+        deletes all expired entries in one statement, returns the number of deleted entries
+        """
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+        return cursor.rowcount
+
+
+class SQLiteKeyring:
+    """
+    keyring compatible view of a SQLiteExpirableStore, installed as os_kr.DEFAULT_KEYRING by os_kr.use_sqlite.
+    entries are stored without an expiration, the factory's meta keeps track of those
+    """
+    store : SQLiteExpirableStore
+
+    def __init__(self, store : SQLiteExpirableStore):
+        self.store = store
+
+    def get_password(self, service : str, username : str) -> typing.Optional[str]:
+        try:
+            return self.store.get_password(service, username)
+        except NotAnExpirableKey:
+            return None
+
+    def set_password(self, service : str, username : str, password : str) -> None:
+        self.store.set_password(service, username, password)
+
+    def delete_password(self, service : str, username : str) -> None:
+        try:
+            self.store.delete_password(service, username)
+        except NotAnExpirableKey:
+            raise PasswordDeleteError("No such password!") from None
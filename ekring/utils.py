@@ -1,4 +1,5 @@
 import datetime
+import math
 import typing
 
 import dateparser
@@ -42,6 +43,23 @@ def parse_readable_date(date : str):
         case _:
             return None
 
+def parse_duration(duration : typing.Union[str, int, float, datetime.timedelta]) -> float:
+    """
+    returns the duration in seconds, accepts "in N unit", timedelta or seconds
+    """
+    match duration:
+        case str(duration):
+            res = parse_readable_date(duration)
+            if res is None:
+                raise ValueError("invalid duration format")
+            return res.total_seconds()
+        case datetime.timedelta():
+            return duration.total_seconds()
+        case int() | float():
+            return float(duration)
+        case _:
+            raise ValueError("invalid duration format")
+
 def yield_every_n_char(string : str, n : int):
     for i in range(0, len(string), n):
         yield string[i:i+n]
@@ -82,11 +100,57 @@ class IncrementCounter:
     
 default_counter = IncrementCounter()
 
+BucketPolicy = typing.Literal["legacy", "exact", "minute", "hour", "day", "log"]
+
+_granularities = {
+    "minute" : 60,
+    "hour" : 3600,
+    "day" : 86400,
+}
+
+def bucket_date(
+    date : datetime.datetime,
+    policy : BucketPolicy = "legacy",
+    now : typing.Optional[datetime.datetime] = None
+):
+    """
+    rounds an expiration into its bucket so expirations share encryption keys
+
+    legacy: dates that are not today are truncated to midnight, today keeps second precision
+    exact: no rounding
+    minute, hour, day: rounded up to the next full minute, hour or day
+    log: rounded up to a power of two seconds (at least a minute) close to 1/16 of the distance from now,
+    so far away buckets are coarser and the number of live buckets grows with the log of the horizon
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    match policy:
+        case "legacy":
+            if date.date() != now.date():
+                return datetime.datetime.combine(date.date(), datetime.time())
+            return date
+        case "exact":
+            return date
+        case "minute" | "hour" | "day":
+            granularity = _granularities[policy]
+            midnight = datetime.datetime.combine(date.date(), datetime.time())
+            offset = math.ceil((date - midnight).total_seconds() / granularity) * granularity
+            return midnight + datetime.timedelta(seconds=offset)
+        case "log":
+            distance = max((date - now).total_seconds(), 1)
+            granularity = max(60, 2 ** int(math.log2(max(distance / 16, 1))))
+            timestamp = math.ceil(date.timestamp() / granularity) * granularity
+            return datetime.datetime.fromtimestamp(timestamp)
+        case _:
+            raise ValueError(f"invalid bucket policy {policy}")
+
 def parse_date_info(
     date : typing.Union[
         str, int, float, datetime.timedelta, datetime.datetime,
         datetime.date
-    ]
+    ],
+    policy : BucketPolicy = "legacy"
 ):
     match date:
         case str(date) if date.startswith("in "):
@@ -106,7 +170,8 @@ def parse_date_info(
             res = datetime.datetime.fromtimestamp(date)
         case date if isinstance(date, datetime.timedelta):
             res = datetime.datetime.now() + date
-            return res
+            if policy == "legacy":
+                return res
         case date if isinstance(date, datetime.datetime):
             res = date
         case date if isinstance(date, datetime.date):
@@ -114,8 +179,4 @@ def parse_date_info(
         case _:
             raise ValueError("invalid date format")
         
-    # for all datetime objects that does not happen today, strip the time part
-    if res.date() != datetime.datetime.now().date():
-        res = datetime.datetime.combine(res.date(), datetime.time())
-
-    return res
+    return bucket_date(res, policy)
@@ -9,7 +9,9 @@ setup(
     install_requires=[
         "keyring",
         "click",
-        "cryptography"
+        "cryptography",
+        "secretstorage; sys_platform == 'linux'",
+        "jeepney; sys_platform == 'linux'"
     ],
     entry_points={
         "console_scripts": [
@@ -1,8 +1,37 @@
 
+from base64 import urlsafe_b64decode
+import os
+import tempfile
+import threading
 from time import sleep
-from unittest import TestCase
+from unittest import TestCase, mock
 
+from ekring import os_kr
 from ekring.ek import AlreadyExpiredKey, ExpirableKeyringFactory
+from ekring.password import generate_password, password_rotate
+
+
+class Interrupted(Exception):
+    pass
+
+
+def iterations_of(token):
+    return int.from_bytes(urlsafe_b64decode(token)[16:20], "big")
+
+
+class CountingKeyring:
+    def __init__(self, keyring):
+        self.keyring = keyring
+        self.writes = 0
+        self.writers = []
+
+    def __getattr__(self, name):
+        return getattr(self.keyring, name)
+
+    def set_password(self, service, username, password):
+        self.writes += 1
+        self.writers.append(threading.current_thread())
+        self.keyring.set_password(service, username, password)
 
 
 class T_EK(TestCase):
@@ -32,4 +61,186 @@ class T_EK(TestCase):
         with self.assertRaises(AlreadyExpiredKey):
             self.factory.get_secret(
                 "test",
-            )
\ No newline at end of file
+            )
+
+    def test_service(self):
+        self.factory.set_password("test.a", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test.a", "u2", "p2", expiration_date="in 2 days")
+        self.factory.set_password("test.b", "u1", "p3", expiration_date="in 3 days")
+
+        self.assertEqual(
+            self.factory.list_service("test.", prefix=True),
+            {"test.a" : ["u1", "u2"], "test.b" : ["u1"]}
+        )
+
+        self.factory.differ_service("test.", "in 5 days", prefix=True)
+        self.assertEqual(self.factory.get_password("test.a", "u2"), "p2")
+        self.assertEqual(self.factory.get_password("test.b", "u1"), "p3")
+
+        self.factory.delete_service("test.a")
+        self.assertEqual(self.factory.list_service("test.a"), {})
+        self.assertEqual(self.factory.list_service("test.b"), {"test.b" : ["u1"]})
+
+    def test_prune_expired(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 1 second")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 1 second")
+        self.factory.set_password("test", "u3", "p3", expiration_date="in 2 days")
+        sleep(2)
+
+        self.factory.prune_expired()
+        self.assertEqual(list(self.factory.meta.name_dates), ["test|u3"])
+        self.assertEqual(len(self.factory.meta.date_encryption), 1)
+        self.assertIsNone(os_kr.get_password("test", "u1"))
+        self.assertIsNone(os_kr.get_password("test", "u2"))
+        self.assertEqual(self.factory.get_password("test", "u3"), "p3")
+
+    def test_rotate_keys(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 3 days")
+        old_keys = dict(self.factory.meta.date_encryption)
+
+        self.assertEqual(self.factory.rotate_keys(max_workers=2), 2)
+
+        self.assertNotEqual(self.factory.meta.date_encryption, old_keys)
+        self.assertEqual(self.factory.meta.pending_rotation, {})
+        self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+        self.assertEqual(self.factory.get_password("test", "u2"), "p2")
+
+    def test_rotate_resume(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 3 days")
+
+        def interrupt(done, total):
+            raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            self.factory.rotate_keys(iterations=1000, max_workers=1, progress=interrupt)
+        self.assertTrue(self.factory.meta.pending_rotation)
+        self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+        self.assertEqual(self.factory.get_password("test", "u2"), "p2")
+
+        # a new process picks the journaled rotation up from the meta
+        factory = ExpirableKeyringFactory(META_NAME=self.factory.META_NAME)
+        self.assertEqual(factory.rotate_keys(), 1)
+        self.assertEqual(factory.meta.pending_rotation, {})
+        self.assertEqual(factory.get_password("test", "u1"), "p1")
+        self.assertEqual(factory.get_password("test", "u2"), "p2")
+        self.assertEqual(iterations_of(os_kr.get_password("test", "u1")), 1000)
+        self.assertEqual(iterations_of(os_kr.get_password("test", "u2")), 1000)
+
+        # the new count sticks for later writes
+        factory.set_password("test", "u3", "p3", expiration_date="in 4 days")
+        self.assertEqual(iterations_of(os_kr.get_password("test", "u3")), 1000)
+        factory.purge_all()
+
+    def test_sliding(self):
+        self.factory.TOUCH_FLUSH_INTERVAL = 1
+        self.factory.set_password("test", "u1", "p1", "in 3 seconds", sliding="in 4 seconds")
+        keyring = CountingKeyring(os_kr.DEFAULT_KEYRING)
+        os_kr.DEFAULT_KEYRING = keyring
+        try:
+            # reads past the flush interval and past the initial expiration
+            for _ in range(8):
+                self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+                sleep(0.5)
+
+            # touches were written by the flush timer, never by a read
+            self.assertGreaterEqual(keyring.writes, 1)
+            self.assertNotIn(threading.current_thread(), keyring.writers)
+        finally:
+            os_kr.DEFAULT_KEYRING = keyring.keyring
+
+        # gone once idle for the sliding window
+        self.factory.flush_touches()
+        sleep(6)
+        with self.assertRaises(AlreadyExpiredKey):
+            self.factory.get_password("test", "u1")
+
+    def test_sliding_moves_whole_bucket(self):
+        self.factory.BUCKET_POLICY = "hour"
+        self.factory.set_password("test", "u1", "p1", "in 1 hour", sliding="in 3 hours")
+        self.factory.set_password("test", "u2", "p2", "in 1 hour", sliding="in 3 hours")
+        old_datestr = self.factory.meta.name_dates["test|u1"]
+        key = self.factory.meta.get_encryption_key(old_datestr)
+
+        keyring = CountingKeyring(os_kr.DEFAULT_KEYRING)
+        os_kr.DEFAULT_KEYRING = keyring
+        try:
+            self.factory.get_password("test", "u1")
+            self.factory.get_password("test", "u2")
+            self.factory.flush_touches()
+            # the bucket handed its key over, only the meta was written
+            self.assertEqual(keyring.writes, 1)
+        finally:
+            os_kr.DEFAULT_KEYRING = keyring.keyring
+
+        datestr = self.factory.meta.name_dates["test|u1"]
+        self.assertNotEqual(datestr, old_datestr)
+        self.assertEqual(self.factory.meta.name_dates["test|u2"], datestr)
+        self.assertEqual(self.factory.meta.date_encryption, {datestr : key})
+        self.assertEqual(self.factory.get_password("test", "u2"), "p2")
+
+    def test_differ_does_not_share_keys(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 2 days")
+
+        self.factory.differ_password_expiration("test", "u1", "in 4 days")
+        keys = self.factory.meta.date_encryption
+        self.assertEqual(len(set(keys.values())), len(keys))
+        self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+
+    def test_differ(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 2 days")
+
+        self.factory.differ_password_expiration("test", "u1", "in 4 days")
+        self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+        self.assertEqual(self.factory.get_password("test", "u2"), "p2")
+
+    def test_differ_during_rotation(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        self.factory.set_password("test", "u2", "p2", expiration_date="in 2 days")
+
+        # u1 was re-encrypted by a rotation that stopped before u2
+        datestr = self.factory.meta.name_dates["test|u1"]
+        self.factory.meta.pending_rotation[datestr] = generate_password()
+        self.factory.meta.update_meta()
+        os_kr.set_password("test", "u1", password_rotate(
+            os_kr.get_password("test", "u1"),
+            self.factory.meta.get_encryption_key(datestr),
+            self.factory.meta.pending_rotation[datestr]
+        ))
+
+        self.factory.differ_password_expiration("test", "u1", "in 4 days")
+        self.assertEqual(self.factory.get_password("test", "u1"), "p1")
+        self.assertEqual(self.factory.get_password("test", "u2"), "p2")
+
+
+class T_EK_SQLite(T_EK):
+    """
+    the same tests on the sqlite backend, which needs no SecretService
+    """
+    def setUp(self) -> None:
+        self.default_keyring = os_kr.DEFAULT_KEYRING
+        self.dir = tempfile.TemporaryDirectory()
+        with mock.patch.dict(os.environ, {"EKRING_SQLITE_SECRET" : "secret"}):
+            self.factory = ExpirableKeyringFactory(BACKEND="sqlite", SQLITE_PATH=os.path.join(self.dir.name, "ek.db"))
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        os_kr.DEFAULT_KEYRING.store.close()
+        os_kr.DEFAULT_KEYRING = self.default_keyring
+        self.dir.cleanup()
+
+    def test_reopen(self):
+        self.factory.set_password("test", "u1", "p1", expiration_date="in 2 days")
+        with mock.patch.dict(os.environ, {"EKRING_SQLITE_SECRET" : "secret"}):
+            factory = ExpirableKeyringFactory(
+                META_NAME=self.factory.META_NAME, BACKEND="sqlite", SQLITE_PATH=self.factory.SQLITE_PATH
+            )
+        self.assertEqual(factory.get_password("test", "u1"), "p1")
+
+    def test_missing_secret(self):
+        with mock.patch.dict(os.environ, {"EKRING_SQLITE_SECRET" : ""}):
+            with self.assertRaises(ValueError):
+                ExpirableKeyringFactory(BACKEND="sqlite", SQLITE_PATH=self.factory.SQLITE_PATH)
@@ -0,0 +1,192 @@
+import datetime
+import os
+import random
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from ekring import os_kr
+from ekring.ek import AlreadyExpiredKey, ExpirableKeyringFactory
+from ekring.events import ExpiryEvents, TimingWheel
+
+
+class T_TimingWheel(TestCase):
+    def test_fires_in_order(self):
+        wheel = TimingWheel(resolution=1, slots=4, levels=2, start=0)
+        offsets = [0, 1, 3, 4, 5, 15, 16, 17, 40, 100]
+        for offset in offsets:
+            wheel.schedule(offset, offset)
+
+        fired = {}
+        for now in range(0, 101):
+            for item in wheel.advance(now):
+                fired[item] = now
+
+        self.assertEqual(fired, {offset : offset for offset in offsets})
+        self.assertEqual(len(wheel), 0)
+
+    def test_schedule_while_turning(self):
+        wheel = TimingWheel(resolution=1, slots=8, levels=3, start=0)
+        rng = random.Random(1)
+        expected = {}
+        fired = {}
+        for now in range(0, 2000):
+            if now < 1000:
+                when = now + rng.randint(0, 900)
+                expected[(now, when)] = when
+                wheel.schedule(when, (now, when))
+            for item in wheel.advance(now):
+                fired[item] = now
+
+        self.assertEqual(fired, expected)
+
+    def test_past_is_due_immediately(self):
+        wheel = TimingWheel(start=100)
+        wheel.schedule(10, "late")
+        self.assertEqual(wheel.advance(100), ["late"])
+
+    def test_long_gap(self):
+        wheel = TimingWheel(start=0)
+        wheel.schedule(50_000_000, "far")
+        wheel.schedule(10, "near")
+
+        start = time.perf_counter()
+        self.assertEqual(wheel.advance(3_000_000), ["near"])
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(wheel.advance(49_999_999), [])
+        self.assertEqual(wheel.advance(50_000_000), ["far"])
+
+
+    def test_irregular_advance(self):
+        wheel = TimingWheel(resolution=1, slots=8, levels=3, start=0)
+        rng = random.Random(2)
+        pending = {}
+        now = 0
+        for i in range(3000):
+            when = now + rng.randint(0, 5000)
+            pending[i] = when
+            wheel.schedule(when, i)
+            now += rng.randint(0, 40)
+            for item in wheel.advance(now):
+                self.assertLessEqual(pending.pop(item), now)
+            self.assertFalse([item for item, when in pending.items() if when <= now])
+
+
+class T_ExpiryEvents(TestCase):
+    def setUp(self) -> None:
+        self.default_keyring = os_kr.DEFAULT_KEYRING
+        self.dir = tempfile.TemporaryDirectory()
+        with mock.patch.dict(os.environ, {"EKRING_SQLITE_SECRET" : "secret"}):
+            self.factory = ExpirableKeyringFactory(
+                BUCKET_POLICY="minute", BACKEND="sqlite", SQLITE_PATH=os.path.join(self.dir.name, "ek.db")
+            )
+        self.events = ExpiryEvents(self.factory)
+        self.fired = []
+
+    def tearDown(self) -> None:
+        self.events.stop()
+        self.factory.flush_touches()
+        os_kr.DEFAULT_KEYRING.store.close()
+        os_kr.DEFAULT_KEYRING = self.default_keyring
+        self.dir.cleanup()
+
+    def expires(self, service, username):
+        datestr = self.factory.meta.name_dates[f"{service}|{username}"]
+        return datetime.datetime.strptime(datestr, self.factory.DATE_FORMAT).timestamp()
+
+    def record(self, kind):
+        return lambda svc, username, _ : self.fired.append((kind, svc, username))
+
+    def test_dispatch(self):
+        self.factory.set_password("s1", "a", "p", "in 1 hour")
+        self.factory.set_password("s1", "b", "p", "in 1 hour")
+        self.factory.set_password("s2", "a", "p", "in 1 hour")
+        self.events.on_expiring(60, self.record("expiring"), service="s1")
+        self.events.on_expired(self.record("expired"), service="s2", username="a")
+        expires = self.expires("s1", "a")
+
+        self.events.poll(expires - 30)
+        self.assertEqual(sorted(self.fired), [("expiring", "s1", "a"), ("expiring", "s1", "b")])
+
+        self.fired.clear()
+        self.events.poll(expires + 1)
+        self.assertEqual(self.fired, [("expired", "s2", "a")])
+
+    def test_set_after_subscribe(self):
+        self.events.on_expired(self.record("expired"))
+        self.factory.set_password("s", "a", "p", "in 1 hour")
+
+        self.events.poll(self.expires("s", "a") + 1)
+        self.assertEqual(self.fired, [("expired", "s", "a")])
+
+    def test_differ(self):
+        self.events.on_expired(self.record("expired"))
+        self.factory.set_password("s", "a", "p", "in 1 hour")
+        self.factory.set_password("s", "b", "p", "in 1 hour")
+        old_expires = self.expires("s", "a")
+
+        self.factory.differ_password_expiration("s", "a", "in 2 hours")
+        self.factory.delete_password("s", "b")
+        self.events.poll(old_expires + 1)
+        self.assertEqual(self.fired, [])
+
+        self.events.poll(self.expires("s", "a") + 1)
+        self.assertEqual(self.fired, [("expired", "s", "a")])
+
+    def test_refresh(self):
+        self.factory.set_password("s", "a", "old", "in 1 hour")
+        self.events.on_expired(self.record("expired"))
+        self.events.on_refresh(60, lambda svc, username, value : value + "!", "in 3 hours", service="s")
+        old_expires = self.expires("s", "a")
+
+        self.events.poll(old_expires - 30)
+        self.assertEqual(self.factory.get_password("s", "a"), "old!")
+        self.assertGreater(self.expires("s", "a"), old_expires)
+
+        self.events.poll(old_expires + 1)
+        self.assertEqual(self.fired, [])
+
+    def test_expired_after_prune(self):
+        self.factory.BUCKET_POLICY = "legacy"
+        self.factory.set_password("s", "a", "p", "in 2 seconds")
+        self.events.on_expired(self.record("expired"))
+        expires = self.expires("s", "a")
+
+        time.sleep(max(expires - time.time(), 0) + 1)
+        with self.assertRaises(AlreadyExpiredKey):
+            self.factory.get_password("s", "a")
+
+        self.events.poll(expires + 1)
+        self.assertEqual(self.fired, [("expired", "s", "a")])
+
+    def test_sliding_touch(self):
+        self.factory.set_password("s", "a", "p", "in 3 seconds", sliding="in 1 hour")
+        self.events.on_expired(self.record("expired"))
+        expires = self.expires("s", "a")
+
+        # the touch is still buffered, the entry is alive past its meta expiration
+        self.factory.get_password("s", "a")
+        self.events.poll(expires + 1)
+        self.assertEqual(self.fired, [])
+
+        self.events.poll(self.factory._touches["s|a"].timestamp() + 1)
+        self.assertEqual(self.fired, [("expired", "s", "a")])
+
+    def test_start(self):
+        self.factory.BUCKET_POLICY = "legacy"
+        self.events.on_expired(self.record("expired"), service="s")
+        self.events.on_refresh(2, lambda svc, username, value : value, "in 1 hour", service="r")
+        self.factory.set_password("s", "a", "p", "in 1 second")
+        self.factory.set_password("r", "a", "p", "in 3 seconds")
+
+        self.events.start()
+        # the poll thread refreshes entries while this thread keeps changing the meta
+        deadline = time.time() + 4
+        i = 0
+        while time.time() < deadline:
+            self.factory.set_password("other", f"u{i % 5}", "p", "in 1 hour")
+            i += 1
+        self.events.stop()
+
+        self.assertEqual(self.fired, [("expired", "s", "a")])
+        self.assertGreater(self.expires("r", "a"), time.time() + 3000)
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from ekring.password import password_decrypt, password_encrypt_with_gen
+from ekring.password import generate_password, password_decrypt, password_encrypt_with_gen, password_rotate
 
 msg = """
 \n\t
@@ -18,3 +18,11 @@ class T_password(TestCase):
         decrypted = password_decrypt(encoded_content, password)
         self.assertEqual(decrypted, msg)
 
+
+    def test_password_rotate(self):
+        content, password = password_encrypt_with_gen(msg)
+        new_password = generate_password()
+
+        rotated = password_rotate(content, password, new_password, 1000)
+        self.assertEqual(password_decrypt(rotated, new_password), msg)
+        self.assertIsNone(password_rotate(rotated, password, new_password, resume=True))
@@ -0,0 +1,91 @@
+import os
+import shutil
+from unittest import TestCase, mock, skipIf
+
+from keyring.backends.SecretService import Keyring
+
+from ekring.secretservice import LocalSecretService, PooledSecretServiceKeyring
+
+
+@skipIf(shutil.which("dbus-daemon") is None, "needs dbus-daemon")
+class T_PooledSecretServiceKeyring(TestCase):
+    def setUp(self) -> None:
+        self.service = LocalSecretService()
+        self.keyring = PooledSecretServiceKeyring(self.service.connect)
+
+    def tearDown(self) -> None:
+        self.keyring.close()
+        self.service.close()
+
+    def test_set_get_delete(self):
+        self.keyring.set_password("test", "u1", "p1")
+        self.keyring.set_password("test", "u1", "p2")
+        self.assertEqual(self.keyring.get_password("test", "u1"), "p2")
+        self.assertIsNone(self.keyring.get_password("test", "u2"))
+
+        self.keyring.delete_password("test", "u1")
+        self.assertIsNone(self.keyring.get_password("test", "u1"))
+
+    def test_single_connection(self):
+        for i in range(10):
+            self.keyring.set_password("test", f"u{i}", f"p{i}")
+
+        # a search and a GetSecrets call per read
+        start = self.service.round_trips
+        for i in range(10):
+            self.assertEqual(self.keyring.get_password("test", f"u{i}"), f"p{i}")
+        self.assertEqual(self.service.round_trips - start, 20)
+        self.assertEqual(self.service.connections, 1)
+
+    def test_get_passwords(self):
+        for i in range(10):
+            self.keyring.set_password("test", f"u{i}", f"p{i}")
+        pairs = [("test", f"u{i}") for i in range(11)]
+
+        # a search per pair and one GetSecrets call for all of them
+        start = self.service.round_trips
+        res = self.keyring.get_passwords(pairs)
+        self.assertEqual(self.service.round_trips - start, 11 + 1)
+        self.assertEqual(res, {("test", f"u{i}") : f"p{i}" if i < 10 else None for i in range(11)})
+
+    def test_delete_passwords(self):
+        self.keyring.set_password("test", "u1", "p1")
+        self.keyring.set_password("test", "u2", "p2")
+
+        self.keyring.delete_passwords([("test", "u1"), ("test", "u3")])
+        self.assertIsNone(self.keyring.get_password("test", "u1"))
+        self.assertEqual(self.keyring.get_password("test", "u2"), "p2")
+
+    def test_reconnect(self):
+        self.keyring.set_password("test", "u1", "p1")
+        self.service.drop_connections()
+
+        self.assertEqual(self.keyring.get_password("test", "u1"), "p1")
+        self.assertEqual(self.service.connections, 2)
+
+    def test_relock(self):
+        self.keyring.set_password("test", "u1", "p1")
+        self.service.locked = True
+
+        # GetSecrets skips the locked item, which is unlocked on its own
+        self.assertEqual(self.keyring.get_password("test", "u1"), "p1")
+        self.assertFalse(self.service.locked)
+        self.assertEqual(self.service.connections, 1)
+
+    def test_preferred_collection(self):
+        with mock.patch.dict(os.environ, {"DBUS_SESSION_BUS_ADDRESS" : self.service.address}):
+            keyring = PooledSecretServiceKeyring(preferred_collection="/org/freedesktop/secrets/collection/login")
+            try:
+                keyring.set_password("test", "u1", "p1")
+                self.assertEqual(keyring._collection.collection_path, "/org/freedesktop/secrets/collection/login")
+            finally:
+                keyring.close()
+            self.assertEqual(self.keyring.get_password("test", "u1"), "p1")
+
+    def test_keyring_compatible(self):
+        self.keyring.set_password("test", "u1", "p1")
+        with mock.patch.dict(os.environ, {"DBUS_SESSION_BUS_ADDRESS" : self.service.address}):
+            backend = Keyring()
+            self.assertEqual(backend.get_password("test", "u1"), "p1")
+            backend.set_password("test", "u2", "p2")
+        self.assertEqual(self.keyring.get_password("test", "u2"), "p2")
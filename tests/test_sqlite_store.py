@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+from time import sleep
+from unittest import TestCase
+
+from ekring.ek import AlreadyExpiredKey, NotAnExpirableKey
+from keyring.errors import PasswordDeleteError
+
+from ekring.sqlite_store import SQLiteExpirableStore, SQLiteKeyring
+
+
+def _read(path):
+    return SQLiteExpirableStore(path, "secret").get_password("test", "u1")
+
+
+class T_SQLiteExpirableStore(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "ek.db")
+        self.store = SQLiteExpirableStore(self.path, "secret")
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_set_get(self):
+        self.store.set_password("test", "u1", "p1", "in 2 days")
+        self.assertEqual(self.store.get_password("test", "u1"), "p1")
+
+        self.store.set_password("test", "u1", "p2", "in 3 days")
+        self.assertEqual(self.store.get_password("test", "u1"), "p2")
+
+        self.store.delete_password("test", "u1")
+        with self.assertRaises(NotAnExpirableKey):
+            self.store.get_password("test", "u1")
+
+    def test_expired(self):
+        self.store.set_many([
+            ("test", "u1", "p1", "in 1 second"),
+            ("test", "u2", "p2", "in 1 second"),
+            ("test", "u3", "p3", "in 2 days"),
+        ])
+        sleep(2)
+
+        with self.assertRaises(AlreadyExpiredKey):
+            self.store.get_password("test", "u1")
+        self.assertEqual(self.store.prune_expired(), 1)
+        self.assertEqual(self.store.list_service("test"), {"test" : ["u3"]})
+
+    def test_list_service(self):
+        self.store.set_many([
+            ("test.a", "u1", "p1", "in 2 days"),
+            ("test.b", "u1", "p2", "in 2 days"),
+            ("other", "u1", "p3", "in 2 days"),
+        ])
+        self.assertEqual(
+            self.store.list_service("test.", prefix=True),
+            {"test.a" : ["u1"], "test.b" : ["u1"]}
+        )
+
+    def test_secret(self):
+        self.store.set_password("test", "u1", "plaintext-marker", "in 2 days")
+        self.store.close()
+        with open(self.path, "rb") as f:
+            self.assertNotIn(b"plaintext-marker", f.read())
+
+        with self.assertRaises(ValueError):
+            SQLiteExpirableStore(self.path, "other")
+
+    def test_processes(self):
+        self.store.set_password("test", "u1", "p1", "in 2 days")
+        with Pool(2) as pool:
+            self.assertEqual(pool.map(_read, [self.path] * 4), ["p1"] * 4)
+
+    def test_exact_expiration(self):
+        self.store.set_password("test", "u1", "p1", "in 2 days")
+        expires = self.store._conn().execute("SELECT expires FROM entries").fetchone()[0]
+        self.assertAlmostEqual(expires, time.time() + 2 * 86400, delta=5)
+
+    def test_list_service_max_char(self):
+        top = chr(0x10FFFF)
+        self.store.set_many([
+            ("a" + top, "u1", "p1", "in 2 days"),
+            ("a" + top + "x", "u1", "p2", "in 2 days"),
+            ("b", "u1", "p3", "in 2 days"),
+            (top, "u1", "p4", "in 2 days"),
+        ])
+        self.assertEqual(
+            self.store.list_service("a" + top, prefix=True),
+            {"a" + top : ["u1"], "a" + top + "x" : ["u1"]}
+        )
+        self.assertEqual(self.store.list_service(top, prefix=True), {top : ["u1"]})
+
+        self.store.set_many([(chr(0xD7FF), "u1", "p5", "in 2 days"), (chr(0xE000), "u1", "p6", "in 2 days")])
+        self.assertEqual(self.store.list_service(chr(0xD7FF), prefix=True), {chr(0xD7FF) : ["u1"]})
+
+    def test_keyring(self):
+        keyring = SQLiteKeyring(self.store)
+        keyring.set_password("test", "u1", "p1")
+        self.assertEqual(keyring.get_password("test", "u1"), "p1")
+        self.assertIsNone(keyring.get_password("test", "u2"))
+
+        # entries without an expiration are never pruned
+        self.assertEqual(self.store.prune_expired(), 0)
+        keyring.delete_password("test", "u1")
+        self.assertIsNone(keyring.get_password("test", "u1"))
+        with self.assertRaises(PasswordDeleteError):
+            keyring.delete_password("test", "u1")
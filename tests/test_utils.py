@@ -2,7 +2,7 @@
 import datetime
 from unittest import TestCase
 
-from ekring.utils import parse_date_info, parse_readable_date
+from ekring.utils import bucket_date, parse_date_info, parse_readable_date
 
 class T_parse_readable_date(TestCase):
     def test_1(self):
@@ -51,4 +51,36 @@ class T_parse_date_info(TestCase):
             datetime.timedelta(days=1, hours=1, minutes=1, seconds=1)
         )
         self.assertTrue(res >= datetime.datetime.now() + datetime.timedelta(days=1))
-        self.assertTrue(res < datetime.datetime.now() + datetime.timedelta(days=2))
\ No newline at end of file
+        self.assertTrue(res < datetime.datetime.now() + datetime.timedelta(days=2))
+
+class T_bucket_date(TestCase):
+    now = datetime.datetime(2024, 5, 1, 12, 0, 0)
+
+    def test_legacy(self):
+        res = bucket_date(datetime.datetime(2024, 5, 1, 13, 5, 7), "legacy", self.now)
+        self.assertEqual(res, datetime.datetime(2024, 5, 1, 13, 5, 7))
+        res = bucket_date(datetime.datetime(2024, 5, 3, 13, 5, 7), "legacy", self.now)
+        self.assertEqual(res, datetime.datetime(2024, 5, 3))
+
+    def test_fixed(self):
+        date = datetime.datetime(2024, 5, 1, 13, 5, 7)
+        self.assertEqual(bucket_date(date, "minute", self.now), datetime.datetime(2024, 5, 1, 13, 6))
+        self.assertEqual(bucket_date(date, "hour", self.now), datetime.datetime(2024, 5, 1, 14))
+        self.assertEqual(bucket_date(date, "day", self.now), datetime.datetime(2024, 5, 2))
+        self.assertEqual(bucket_date(datetime.datetime(2024, 5, 2), "day", self.now), datetime.datetime(2024, 5, 2))
+
+    def test_log(self):
+        near = [bucket_date(self.now + datetime.timedelta(seconds=s), "log", self.now) for s in range(60, 600)]
+        far = [
+            bucket_date(self.now + datetime.timedelta(days=60, seconds=s), "log", self.now)
+            for s in range(0, 86400, 60)
+        ]
+
+        for offset, res in enumerate(near, 60):
+            self.assertGreaterEqual(res, self.now + datetime.timedelta(seconds=offset))
+        self.assertLessEqual(len(set(far)), 2)
+        self.assertGreater(len(set(near)), len(set(far)))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            bucket_date(self.now, "week", self.now)